@@ -0,0 +1,145 @@
+"""Measure how fast file-system paths are computed for long URL lists.
+
+The former uncached get_fs_path is compared with the memoised one, on
+a cold and a warm cache, and with the batch API. The results are
+printed (or written) as JSON, one record per list. For example:
+
+    python bench/bench_fs_path.py --urls 100000 --distinct 0.1 1
+
+"""
+
+from tts_tools import libtts
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark get_fs_path on synthetic URL lists."
+)
+
+parser.add_argument(
+    "--urls",
+    type=int,
+    default=100000,
+    help="Number of references per list.",
+)
+
+parser.add_argument(
+    "--distinct",
+    type=float,
+    nargs="+",
+    default=[0.05, 0.5, 1],
+    help="Shares of distinct URLs to try.",
+)
+
+parser.add_argument(
+    "--output",
+    "-o",
+    default=None,
+    help="Append results to this file instead of printing them.",
+)
+
+KEYS = ("ImageURL", "FaceURL", "BackURL", "DiffuseURL", "MeshURL")
+
+
+def get_fs_path_uncached(path, url):
+    """get_fs_path as it was before it was memoised, for reference."""
+
+    recoded_name = re.sub(r"[\W_]", "", url)
+
+    if path[-1] in ("MeshURL", "ColliderURL"):
+        return os.path.join(libtts.OBJPATH, recoded_name + ".obj")
+    elif path[-1] in ("AssetbundleURL", "AssetbundleSecondaryURL"):
+        return os.path.join(libtts.BUNDLEPATH, recoded_name + ".unity3d")
+    elif path[-1] in ("CurrentAudioURL", "AudioLibrary"):
+        return os.path.join(libtts.AUDIOPATH, recoded_name + ".MP3")
+    elif path[-1] == "PDFUrl":
+        return os.path.join(libtts.PDFPATH, recoded_name + ".PDF")
+    else:
+        suffix = ".png" if url.find(".png") > 0 else ".jpg"
+        return os.path.join(libtts.IMGPATH, recoded_name + suffix)
+
+
+def make_refs(count, distinct, seed=0):
+
+    rng = random.Random(seed)
+    pool = max(int(count * distinct), 1)
+    refs = []
+    for _ in range(count):
+        n = rng.randrange(pool)
+        key = KEYS[n % len(KEYS)]
+        url = "http://cloud-3.steamusercontent.com/ugc/{}/{:X}/".format(
+            n, n * 7919
+        )
+        refs.append((["ObjectStates", "CustomImage", key], url))
+    return refs
+
+
+def timed(function):
+
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def clear_caches():
+
+    libtts.recodeURL.cache_clear()
+    libtts.get_key_fs_path.cache_clear()
+
+
+def main():
+
+    args = parser.parse_args()
+
+    for distinct in args.distinct:
+
+        refs = make_refs(args.urls, distinct)
+
+        uncached_time, expected = timed(
+            lambda: [get_fs_path_uncached(path, url) for path, url in refs]
+        )
+
+        clear_caches()
+        cold_time, paths = timed(
+            lambda: [libtts.get_fs_path(path, url) for path, url in refs]
+        )
+        assert paths == expected
+        warm_time, _ = timed(
+            lambda: [libtts.get_fs_path(path, url) for path, url in refs]
+        )
+
+        clear_caches()
+        batch_time, paths = timed(lambda: libtts.get_fs_paths(refs))
+        assert paths == expected
+
+        result = dict(
+            benchmark="fs_path",
+            python=platform.python_version(),
+            urls=args.urls,
+            distinct=distinct,
+            cache_size=libtts.PATH_CACHE_SIZE,
+            uncached_time=uncached_time,
+            cold_time=cold_time,
+            warm_time=warm_time,
+            batch_time=batch_time,
+        )
+        line = json.dumps(result)
+
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as outfile:
+                print(line, file=outfile)
+            print(line, file=sys.stderr)
+        else:
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Measure the throughput and memory use of tts-prefetch against a local
+stand-in server.
+
+Every combination of the given settings is run against a fresh
+gamedata directory, and the results are printed (or written) as JSON,
+one record per line. For example:
+
+    python bench/bench_prefetch.py --urls 2000 --jobs 1 8 --latency 0.02
+
+"""
+
+from contextlib import redirect_stderr
+from contextlib import redirect_stdout
+from standin import make_save
+from standin import StandInServer
+from tts_tools.libtts import AUDIOPATH
+from tts_tools.libtts import BUNDLEPATH
+from tts_tools.libtts import IMGPATH
+from tts_tools.libtts import OBJPATH
+from tts_tools.libtts import PDFPATH
+from tts_tools.prefetch import prefetch_saves
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark tts-prefetch against a local stand-in server."
+)
+
+parser.add_argument(
+    "--urls",
+    type=int,
+    default=2000,
+    help="Number of URLs per synthetic save.",
+)
+
+parser.add_argument(
+    "--saves",
+    type=int,
+    default=1,
+    help="Number of synthetic saves.",
+)
+
+parser.add_argument(
+    "--shared",
+    type=float,
+    default=0.5,
+    help="Share of URLs common to all saves.",
+)
+
+parser.add_argument(
+    "--jobs",
+    type=int,
+    nargs="+",
+    default=[1, 8, 32],
+    help="Numbers of parallel downloads to try.",
+)
+
+parser.add_argument(
+    "--latency",
+    type=float,
+    nargs="+",
+    default=[0, 0.02],
+    help="Server latencies in s to try.",
+)
+
+parser.add_argument(
+    "--bandwidth",
+    type=int,
+    nargs="+",
+    default=[0],
+    help="Bandwidth caps per connection in bytes/s to try (0 for none).",
+)
+
+parser.add_argument(
+    "--error-rate",
+    type=float,
+    nargs="+",
+    default=[0],
+    help="Shares of failing URLs to try.",
+)
+
+parser.add_argument(
+    "--size",
+    type=int,
+    default=10000,
+    help="Size of each asset in bytes.",
+)
+
+parser.add_argument(
+    "--output",
+    "-o",
+    default=None,
+    help="Append results to this file instead of printing them.",
+)
+
+
+def run(args, jobs, latency, bandwidth, error_rate):
+
+    with tempfile.TemporaryDirectory() as tempdir, StandInServer(
+        latency=latency,
+        bandwidth=bandwidth,
+        error_rate=error_rate,
+        size=args.size,
+    ) as server:
+
+        gamedata_dir = os.path.join(tempdir, "gamedata")
+        for path in (IMGPATH, OBJPATH, BUNDLEPATH, AUDIOPATH, PDFPATH):
+            os.makedirs(os.path.join(gamedata_dir, path))
+
+        filenames = []
+        for seed in range(args.saves):
+            filename = os.path.join(tempdir, "save{}.json".format(seed))
+            make_save(
+                filename,
+                server,
+                args.urls,
+                shared=int(args.urls * args.shared),
+                seed=seed,
+            )
+            filenames.append(filename)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(
+            devnull
+        ), redirect_stderr(devnull):
+            prefetch_saves(
+                filenames,
+                gamedata_dir=gamedata_dir,
+                jobs=jobs,
+                retries=0,
+                max_host_failures=0,
+            )
+
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        fetched_bytes = 0
+        fetched = 0
+        for dirpath, _, names in os.walk(os.path.join(gamedata_dir, "Mods")):
+            for name in names:
+                fetched += 1
+                fetched_bytes += os.path.getsize(os.path.join(dirpath, name))
+
+        return dict(
+            benchmark="prefetch",
+            python=platform.python_version(),
+            urls=args.urls,
+            saves=args.saves,
+            shared=args.shared,
+            size=args.size,
+            jobs=jobs,
+            latency=latency,
+            bandwidth=bandwidth,
+            error_rate=error_rate,
+            requests=server.requests,
+            fetched=fetched,
+            bytes=fetched_bytes,
+            wall_time=wall_time,
+            urls_per_s=server.requests / wall_time,
+            throughput=fetched_bytes / wall_time,
+            peak_memory=peak_memory,
+        )
+
+
+def main():
+
+    args = parser.parse_args()
+
+    settings = itertools.product(
+        args.jobs, args.latency, args.bandwidth, args.error_rate
+    )
+    for jobs, latency, bandwidth, error_rate in settings:
+
+        result = run(args, jobs, latency, bandwidth, error_rate)
+        line = json.dumps(result)
+
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as outfile:
+                print(line, file=outfile)
+            print(line, file=sys.stderr)
+        else:
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Compare the iterative seekURL with the former recursive one on large,
+deeply nested synthetic saves.
+
+The results are printed (or written) as JSON, one record per save size
+and depth. For example:
+
+    python bench/bench_seekurl.py --objects 20000 --depth 1 8 32
+
+"""
+
+from tts_tools.libtts import seekURL
+
+import argparse
+import json
+import platform
+import random
+import re
+import sys
+import time
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark seekURL on synthetic saves."
+)
+
+parser.add_argument(
+    "--objects",
+    type=int,
+    nargs="+",
+    default=[1000, 10000, 50000],
+    help="Numbers of objects per synthetic save to try.",
+)
+
+parser.add_argument(
+    "--depth",
+    type=int,
+    nargs="+",
+    default=[1, 8, 32],
+    help="Nesting depths of contained objects to try.",
+)
+
+parser.add_argument(
+    "--repeat",
+    type=int,
+    default=3,
+    help="Number of runs per setting; the fastest one counts.",
+)
+
+parser.add_argument(
+    "--output",
+    "-o",
+    default=None,
+    help="Append results to this file instead of printing them.",
+)
+
+
+def seekURL_recursive(dic, trail=[]):
+    """seekURL as it was before it became iterative, for reference."""
+
+    for k, v in dic.items():
+
+        newtrail = trail + [k]
+
+        if k == "AudioLibrary":
+            for elem in v:
+                yield (newtrail, elem["Item1"])
+
+        elif isinstance(v, dict):
+            yield from seekURL_recursive(v, newtrail)
+
+        elif isinstance(v, list):
+            for elem in v:
+                if not isinstance(elem, dict):
+                    continue
+                yield from seekURL_recursive(elem, newtrail)
+
+        elif k.lower().endswith("url"):
+            if k == "PageURL":
+                continue
+            if not v:
+                continue
+            v = re.sub(r"{.*}", "", v)
+            yield (newtrail, v)
+
+
+def make_object(rng, n):
+
+    return {
+        "Name": "Custom_Model",
+        "GUID": "{:06x}".format(n),
+        "Transform": {"posX": rng.random(), "posY": 1.0, "posZ": 0.0},
+        "ColorDiffuse": {"r": 1.0, "g": 1.0, "b": 1.0},
+        "Nickname": "Object {}".format(n),
+        "Tags": ["a", "b"],
+        "CustomMesh": {
+            "MeshURL": "http://example.com/{}.obj".format(n),
+            "DiffuseURL": "http://example.com/{{x}}{}.png".format(n),
+            "NormalURL": "",
+        },
+    }
+
+
+def make_save(objects, depth, seed=0):
+    """Return a save with the given number of objects, nested in chains
+    of ContainedObjects depth levels deep.
+
+    """
+
+    rng = random.Random(seed)
+    states = []
+    for n in range(0, objects, depth):
+        top = make_object(rng, n)
+        obj = top
+        for m in range(n + 1, min(n + depth, objects)):
+            child = make_object(rng, m)
+            obj["ContainedObjects"] = [child]
+            obj = child
+        states.append(top)
+    return {"SaveName": "Synthetic", "ObjectStates": states}
+
+
+def measure(function, save, repeat):
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in function(save))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main():
+
+    args = parser.parse_args()
+
+    for objects in args.objects:
+        for depth in args.depth:
+
+            save = make_save(objects, depth)
+            old_time, old_count = measure(seekURL_recursive, save, args.repeat)
+            new_time, new_count = measure(seekURL, save, args.repeat)
+            assert old_count == new_count
+
+            result = dict(
+                benchmark="seekURL",
+                python=platform.python_version(),
+                objects=objects,
+                depth=depth,
+                urls=new_count,
+                recursive_time=old_time,
+                iterative_time=new_time,
+                speedup=old_time / new_time,
+            )
+            line = json.dumps(result)
+
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as outfile:
+                    print(line, file=outfile)
+                print(line, file=sys.stderr)
+            else:
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""A local HTTP server standing in for the hosts that mods load their
+assets from, along with generators for synthetic saves referring to it.
+
+The server answers every path with synthetic content. Latency,
+bandwidth, error rate and the content type per file suffix can be
+configured, so that the download path of tts-prefetch can be measured
+without touching the network.
+
+"""
+
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".obj": "text/plain",
+    ".unity3d": "application/octet-stream",
+    ".mp3": "audio/mpeg",
+    ".pdf": "application/pdf",
+}
+
+# Assets of a synthetic save: the key referring to them, their suffix,
+# and their share among all URLs.
+ASSET_MIX = (
+    ("ImageURL", ".png", 0.5),
+    ("DiffuseURL", ".jpg", 0.2),
+    ("MeshURL", ".obj", 0.15),
+    ("AssetbundleURL", ".unity3d", 0.05),
+    ("AudioLibrary", ".mp3", 0.05),
+    ("PDFUrl", ".pdf", 0.05),
+)
+
+
+class StandInServer:
+    """A threaded HTTP server for synthetic assets, running in the
+    background while used as a context manager.
+
+    latency is the delay in seconds before each response, bandwidth
+    caps the bytes per second sent on each connection (0 for no cap),
+    and error_rate is the share of paths that fail with 404 or 503.
+    Errors are chosen deterministically per path, based on seed.
+
+    """
+
+    def __init__(
+        self,
+        latency=0,
+        bandwidth=0,
+        error_rate=0,
+        size=10000,
+        content_types=CONTENT_TYPES,
+        seed=0,
+    ):
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.size = size
+        self.content_types = content_types
+        self.seed = seed
+
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        self.httpd = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), make_handler(self)
+        )
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def __enter__(self):
+
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    @property
+    def base_url(self):
+
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def url(self, name):
+
+        return "{}/{}".format(self.base_url, name)
+
+    def get_error(self, path):
+        """Return the error status for path, or None if it succeeds."""
+
+        if not self.error_rate:
+            return None
+        rng = random.Random("{}:{}".format(self.seed, path))
+        if rng.random() >= self.error_rate:
+            return None
+        return rng.choice((404, 503))
+
+    def get_body(self, path):
+
+        match = re.search(r"[?&]size=(\d+)", path)
+        size = int(match.group(1)) if match else self.size
+        seed = hashlib.sha1(path.encode("utf-8")).digest()
+        return (seed * (size // len(seed) + 1))[:size]
+
+    def get_content_type(self, path):
+
+        path = path.split("?")[0]
+        for suffix, content_type in self.content_types.items():
+            if path.endswith(suffix):
+                return content_type
+        return "application/octet-stream"
+
+
+def make_handler(server):
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+
+            with server.lock:
+                server.requests += 1
+
+            if server.latency:
+                time.sleep(server.latency)
+
+            error = server.get_error(self.path)
+            if error:
+                self.send_response(error)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            body = server.get_body(self.path)
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start = 0
+            match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+            if match and self.headers.get("If-Range", etag) == etag:
+                start = min(int(match.group(1)), len(body))
+
+            self.send_response(206 if start else 200)
+            self.send_header(
+                "Content-Type", server.get_content_type(self.path)
+            )
+            self.send_header("Content-Length", str(len(body) - start))
+            self.send_header("ETag", etag)
+            if start:
+                self.send_header(
+                    "Content-Range",
+                    "bytes {}-{}/{}".format(start, len(body) - 1, len(body)),
+                )
+            self.end_headers()
+            self.send_body(body[start:])
+
+        def send_body(self, body):
+
+            if not server.bandwidth:
+                self.wfile.write(body)
+                return
+
+            chunk_size = 16 * 1024
+            for start in range(0, len(body), chunk_size):
+                end = start + chunk_size
+                chunk = body[start:end]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / server.bandwidth)
+
+        def log_message(self, *args):
+
+            pass
+
+    return Handler
+
+
+def make_save(filename, server, count, shared=0, seed=0):
+    """Write a synthetic save referring to count assets on server.
+
+    The first shared assets are named alike in every save, so that
+    saves generated with different seeds have them in common.
+
+    """
+
+    rng = random.Random(seed)
+    keys = [key for key, _, _ in ASSET_MIX]
+    weights = [weight for _, _, weight in ASSET_MIX]
+    suffixes = {key: suffix for key, suffix, _ in ASSET_MIX}
+
+    objects = []
+    audio = []
+    for n in range(count):
+        if n < shared:
+            # Choose shared assets independently of the seed.
+            key = random.Random(n).choices(keys, weights)[0]
+            prefix = "shared"
+        else:
+            key = rng.choices(keys, weights)[0]
+            prefix = "save{}".format(seed)
+        url = server.url("{}/{}{}".format(prefix, n, suffixes[key]))
+        if key == "AudioLibrary":
+            audio.append({"Item1": url, "Item2": "Track {}".format(n)})
+        else:
+            objects.append({"Name": "Custom", "Custom": {key: url}})
+
+    save = {
+        "SaveName": "Synthetic save {}".format(seed),
+        "ObjectStates": objects,
+        "Lighting": {"LutURL": ""},
+        "MusicPlayer": {"AudioLibrary": audio},
+    }
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(save, outfile)
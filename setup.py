@@ -43,6 +43,7 @@ setup(
     ],
     extras_require={
         "dev": [
+            "black==22.3.0",
             "pytest==6.2.2",
             "pytest-black==0.3.12",
             "pytest-flake8==1.0.7",
@@ -1,90 +1,402 @@
+from contextlib import suppress
+from tts_tools.backup.store import backup_to_store
+from tts_tools.cacheindex import CacheIndex
+from tts_tools.libtts import AssetTable
+from tts_tools.libtts import find_saves
+from tts_tools.libtts import get_asset_type
 from tts_tools.libtts import get_fs_path
-from tts_tools.libtts import IllegalSavegameException
-from tts_tools.libtts import urls_from_save
+from tts_tools.libtts import load_saves
+from tts_tools.libtts import OBJ
+from tts_tools.saveindex import SaveIndex
+from tts_tools.util import get_member_name
 from tts_tools.util import print_err
 from tts_tools.util import ZipFile
+from zipfile import BadZipFile
+from zipfile import ZIP_BZIP2
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_LZMA
+from zipfile import ZIP_STORED
 
+import copy
+import json
 import os
 import re
 import sys
 
 
-def backup_json(args):
+# Meshes and saves are text, and compress well. Images, audio, asset
+# bundles and PDFs are compressed already, so they are stored as they
+# are.
+COMPRESSIBLE_KINDS = (OBJ,)
 
-    try:
-        urls = urls_from_save(args.infile_name)
-    except (FileNotFoundError, IllegalSavegameException) as error:
-        errmsg = "Could not read URLs from '{file}': {error}".format(
-            file=args.infile_name, error=error
+# Archives of several saves hold this member, which lists the files
+# each save refers to.
+MANIFEST_NAME = "MANIFEST.json"
+
+COMPRESSION_METHODS = {
+    "deflate": ZIP_DEFLATED,
+    "lzma": ZIP_LZMA,
+    "bzip2": ZIP_BZIP2,
+    "store": ZIP_STORED,
+}
+
+
+def backup_json(args, save_index=None, cache_index=None, savegames=None):
+    """Back up one or more saves into a single archive, storing each
+    file they refer to once. A save index and cache index can be passed
+    in to share them between several backups, as can the saves, if
+    loaded already by load_backup_saves.
+
+    Files are read from below args.gamedata_dir, and args is left as it
+    is, so several backups can run in threads at the same time.
+
+    """
+
+    infile_names = args.infile_names
+    gamedata_dir = os.path.abspath(args.gamedata_dir)
+    if not os.path.isdir(gamedata_dir):
+        errmsg = "Could not open gamedata directory '{dir}'.".format(
+            dir=args.gamedata_dir
         )
         print_err(errmsg)
         sys.exit(1)
 
-    # Change working dir, since get_fs_path gives us a relative path.
-    orig_path = os.getcwd()
-    try:
-        os.chdir(args.gamedata_dir)
-    except FileNotFoundError as error:
-        errmsg = "Could not open gamedata directory '{dir}': {error}".format(
-            dir=args.gamedata_dir, error=error
+    if savegames is None:
+        savegames = load_backup_saves(
+            infile_names, args, gamedata_dir, save_index
         )
-        print_err(errmsg)
-        sys.exit(1)
 
-    # We also need to correct the the destination path now.
+    for infile_name, savegame in zip(infile_names, savegames):
+        if isinstance(savegame, Exception):
+            errmsg = "Could not read URLs from '{file}': {error}".format(
+                file=infile_name, error=savegame
+            )
+            print_err(errmsg)
+            sys.exit(1)
+
+    if args.store_name:
+        save_names = get_save_relnames(infile_names, gamedata_dir)
+        backup_to_store(args, savegames, save_names, gamedata_dir)
+        return
+
+    save_arcnames = get_save_arcnames(infile_names, gamedata_dir)
+
+    if cache_index is None:
+        cache_index = CacheIndex(gamedata_dir)
+
     if args.outfile_name:
-        args.outfile_name = os.path.join(orig_path, args.outfile_name)
+        archive_name = os.path.abspath(args.outfile_name)
     else:
         outfile_basename = re.sub(
-            r"\.json$", "", os.path.basename(args.infile_name)
+            r"\.json$", "", os.path.basename(infile_names[0])
         )
-        args.outfile_name = os.path.join(orig_path, outfile_basename) + ".zip"
+        archive_name = os.path.abspath(outfile_basename + ".zip")
+
+    base = None
+    outfile_name = archive_name
+    if args.base_name:
+        base_name = os.path.abspath(args.base_name)
+        try:
+            base = ZipFile(base_name, "r")
+        except (OSError, BadZipFile) as error:
+            errmsg = "Could not read base archive '{base}': {error}".format(
+                base=base_name, error=error
+            )
+            print_err(errmsg)
+            sys.exit(1)
+
+        if os.path.exists(outfile_name) and os.path.samefile(
+            base_name, outfile_name
+        ):
+            if args.delta:
+                base.close()
+                print_err("A delta archive cannot replace its base archive.")
+                sys.exit(1)
+            # Build the new archive next to the old one, which is still
+            # needed until the new one is complete.
+            outfile_name += ".new"
 
     try:
         zipfile = ZipFile(
-            args.outfile_name,
+            outfile_name,
             "w",
             dry_run=args.dry_run,
             ignore_missing=args.ignore_missing,
+            root=gamedata_dir,
+            cache_index=cache_index,
+            jobs=args.jobs,
+            base=base,
+            delta=args.delta,
         )
     except FileNotFoundError as error:
         errmsg = "Could not write to Zip archive '{outfile}': {error}".format(
-            outfile=args.outfile_name, error=error
+            outfile=outfile_name, error=error
         )
         print_err(errmsg)
+        if base:
+            base.close()
         sys.exit(1)
 
-    with zipfile as outfile:
-
-        for path, url in urls:
-
-            filename = get_fs_path(path, url)
-            try:
-                outfile.write(filename)
+    try:
+        write_members(args, savegames, save_arcnames, zipfile)
+    except BaseException:
+        # Don’t leave an incomplete rebuild next to the archive.
+        if outfile_name != archive_name:
+            with suppress(FileNotFoundError):
+                os.remove(outfile_name)
+        raise
+    finally:
+        if base:
+            base.close()
 
-            except FileNotFoundError as error:
-                errmsg = "Could not write {filename} to Zip ({error}).".format(
-                    filename=filename, error=error
-                )
-                print_err(errmsg, "Aborting.", sep="\n", end=" ")
-                if not args.dry_run:
-                    print_err("Zip file is incomplete.")
-                else:
-                    print_err()
-                sys.exit(1)
+    if outfile_name != archive_name and not args.dry_run:
+        os.replace(outfile_name, archive_name)
 
-        # Finally, include the save file itself.
-        orig_json = os.path.join(orig_path, args.infile_name)
-        outfile.write(orig_json, os.path.basename(args.infile_name))
+    if base:
+        print(
+            "{count} unchanged files {action} {base}.".format(
+                count=zipfile.unchanged_count,
+                action="found in" if args.delta else "copied from",
+                base=base.filename,
+            )
+        )
 
-        # Store some metadata.
-        outfile.put_metadata(comment=args.comment)
+    if len(infile_names) == 1:
+        saves = infile_names[0]
+    else:
+        saves = "{} saves".format(len(infile_names))
 
     if args.dry_run:
-        print("Dry run for {file} completed.".format(file=args.infile_name))
+        print("Dry run for {file} completed.".format(file=saves))
     else:
         print(
             "Backed-up contents for {file} found in {outfile}.".format(
-                file=args.infile_name, outfile=args.outfile_name
+                file=saves, outfile=archive_name
+            )
+        )
+
+
+def load_backup_saves(filenames, args, gamedata_dir, save_index=None):
+    """Load the saves filenames, in args.parse_workers processes, and
+    through save_index or, with args.use_index, an index of its own.
+
+    Return a list holding the SaveGame of each save, or the error that
+    kept it from being loaded.
+
+    """
+
+    own_index = save_index is None and args.use_index
+    if own_index:
+        save_index = SaveIndex(gamedata_dir)
+
+    try:
+        if save_index:
+            loaded = save_index.load_saves(
+                filenames, args.parse_workers, return_errors=True
+            )
+        else:
+            loaded = load_saves(
+                filenames, args.parse_workers, return_errors=True
+            )
+        return list(loaded)
+
+    finally:
+        if own_index:
+            save_index.close()
+
+
+def get_save_arcnames(filenames, gamedata_dir):
+    """Return the names to store saves under in an archive. A single
+    save is stored at the top of the archive. Several saves are stored
+    as by get_save_relnames.
+
+    """
+
+    if len(filenames) == 1:
+        return [os.path.basename(filenames[0])]
+    return get_save_relnames(filenames, gamedata_dir)
+
+
+def get_save_relnames(filenames, gamedata_dir):
+    """Return the paths of saves within the gamedata directory, or their
+    base names if they are outside of it. Exit if several saves would
+    get the same name.
+
+    """
+
+    gamedata_dir = os.path.abspath(gamedata_dir)
+    arcnames = []
+    for filename in filenames:
+        try:
+            relname = os.path.relpath(os.path.abspath(filename), gamedata_dir)
+        except ValueError:
+            # On another drive.
+            relname = os.pardir
+        if relname.split(os.sep)[0] == os.pardir:
+            relname = os.path.basename(filename)
+        arcnames.append(get_member_name(relname))
+
+    duplicates = sorted(
+        arcname for arcname in set(arcnames) if arcnames.count(arcname) > 1
+    )
+    if duplicates:
+        print_err("Several saves would be stored as:", *duplicates, sep="\n")
+        sys.exit(1)
+
+    return arcnames
+
+
+def write_members(args, savegames, save_arcnames, zipfile):
+    "Write the files savegames refer to and the saves themselves."
+
+    compression = COMPRESSION_METHODS[args.compression]
+    assets = AssetTable()
+    manifest = {}
+
+    with zipfile as outfile:
+
+        for savegame, arcname in zip(savegames, save_arcnames):
+            refs = assets.distinct(assets.extend(savegame.urls))
+            manifest[arcname] = dict(
+                name=savegame.name,
+                files=write_assets(args, refs, outfile, compression),
+            )
+
+        # Finally, include the saves themselves.
+        for infile_name, arcname in zip(args.infile_names, save_arcnames):
+            outfile.write(
+                os.path.abspath(infile_name),
+                arcname,
+                compress_type=compression,
+            )
+
+        if len(savegames) > 1:
+            outfile.writestr(
+                MANIFEST_NAME,
+                json.dumps(dict(saves=manifest), indent=2),
+                compress_type=compression,
+            )
+
+        # Store some metadata.
+        outfile.put_metadata(comment=args.comment)
+
+
+def write_assets(args, refs, outfile, compression):
+    """Write the files of the (path, URL) pairs refs, unless they have
+    been written already, and return their names within the archive.
+
+    """
+
+    names = {}
+
+    for path, url in refs:
+
+        filename = get_fs_path(path, url)
+        names[get_member_name(filename)] = None
+        if get_asset_type(path, url).kind in COMPRESSIBLE_KINDS:
+            compress_type = compression
+        else:
+            compress_type = ZIP_STORED
+
+        try:
+            outfile.write(filename, compress_type=compress_type)
+
+        except FileNotFoundError as error:
+            errmsg = "Could not write {filename} to Zip ({error}).".format(
+                filename=filename, error=error
             )
+            print_err(errmsg, "Aborting.", sep="\n", end=" ")
+            if not args.dry_run:
+                print_err("Zip file is incomplete.")
+            else:
+                print_err()
+            sys.exit(1)
+
+    return list(names)
+
+
+def backup_library(args):
+    """Back up all saves and workshop mods in the gamedata directory.
+
+    If args.outfile_name is set, they are written to a single archive,
+    and if args.store_name is set, to an asset store. Otherwise, one
+    archive is written per save. The archives are placed below
+    args.outdir_name, at the paths of their saves within the gamedata
+    directory.
+
+    """
+
+    gamedata_dir = os.path.abspath(args.gamedata_dir)
+    outdir_name = os.path.abspath(args.outdir_name)
+    if args.base_name:
+        base_dir = os.path.abspath(args.base_name)
+
+    filenames = find_saves(gamedata_dir, args.include, args.exclude)
+    if not filenames:
+        print_err("No saves found in {}.".format(gamedata_dir))
+        return
+
+    if args.outfile_name or args.store_name:
+        args = copy.copy(args)
+        args.infile_names = filenames
+        args.gamedata_dir = gamedata_dir
+        backup_json(args)
+        return
+
+    save_index = SaveIndex(gamedata_dir) if args.use_index else None
+    cache_index = CacheIndex(gamedata_dir)
+
+    failed = []
+
+    try:
+        # With several workers, parse all saves up front. Otherwise,
+        # each save is parsed in its turn.
+        if args.parse_workers > 1:
+            savegames = load_backup_saves(
+                filenames, args, gamedata_dir, save_index
+            )
+        else:
+            savegames = [None] * len(filenames)
+
+        for filename, savegame in zip(filenames, savegames):
+
+            relname = os.path.relpath(filename, gamedata_dir)
+            zipname = re.sub(r"\.json$", "", relname) + ".zip"
+            outfile_name = os.path.join(outdir_name, zipname)
+            if not args.dry_run:
+                os.makedirs(os.path.dirname(outfile_name), exist_ok=True)
+
+            save_args = copy.copy(args)
+            save_args.infile_names = [filename]
+            save_args.outfile_name = outfile_name
+            save_args.gamedata_dir = gamedata_dir
+            if args.base_name:
+                # Saves new since the previous backup are backed up in full.
+                base_name = os.path.join(base_dir, zipname)
+                if not os.path.isfile(base_name):
+                    base_name = None
+                save_args.base_name = base_name
+
+            # Errors have been reported; carry on with the other saves.
+            try:
+                backup_json(
+                    save_args,
+                    save_index,
+                    cache_index,
+                    [savegame] if savegame is not None else None,
+                )
+            except SystemExit:
+                failed.append(filename)
+
+    finally:
+        if save_index:
+            save_index.close()
+
+    print(
+        "Backed up {} of {} saves.".format(
+            len(filenames) - len(failed), len(filenames)
         )
+    )
+    if failed:
+        print_err("Could not back up:", *failed, sep="\n")
+        sys.exit(1)
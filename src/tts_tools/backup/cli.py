@@ -1,4 +1,6 @@
 from tts_tools.backup import backup_json
+from tts_tools.backup import backup_library
+from tts_tools.backup.store import collect_store_garbage
 from tts_tools.libtts import GAMEDATA_DEFAULT
 
 import argparse
@@ -9,9 +11,11 @@ parser = argparse.ArgumentParser(
 )
 
 parser.add_argument(
-    "infile_name",
+    "infile_names",
     metavar="FILENAME",
-    help="The save file or mod in JSON format.",
+    nargs="*",
+    help="The save files or mods in JSON format. Several saves are backed "
+    "up into a single archive, storing shared files once.",
 )
 
 parser.add_argument(
@@ -28,7 +32,8 @@ parser.add_argument(
     dest="outfile_name",
     metavar="FILENAME",
     default=None,
-    help="The name for the output archive.",
+    help="The name for the output archive. Required for several saves. With "
+    "--all, back up all saves into this single archive.",
 )
 
 parser.add_argument(
@@ -57,8 +62,138 @@ parser.add_argument(
     help="A comment to be stored in the resulting Zip.",
 )
 
+parser.add_argument(
+    "--compression",
+    dest="compression",
+    choices=("deflate", "lzma", "bzip2", "store"),
+    default="deflate",
+    help="How to compress meshes and the save itself. Images, audio, asset "
+    "bundles and PDFs are always stored as they are.",
+)
+
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    type=int,
+    default=1,
+    help="Read and compress this many files in parallel.",
+)
+
+parser.add_argument(
+    "--base",
+    dest="base_name",
+    metavar="ARCHIVE",
+    default=None,
+    help="A previous backup. Files unchanged since then are copied from it "
+    "without compressing them again. With --all, the directory of a "
+    "previous --all backup, unless --outname is given.",
+)
+
+parser.add_argument(
+    "--delta",
+    dest="delta",
+    default=False,
+    action="store_true",
+    help="With --base, leave out unchanged files instead of copying them.",
+)
+
+parser.add_argument(
+    "--store",
+    dest="store_name",
+    metavar="PATH",
+    default=None,
+    help="Instead of a Zip archive, write to an asset store in this "
+    "directory, which holds every file once under its SHA-256, and a "
+    "manifest for every backup of a save.",
+)
+
+parser.add_argument(
+    "--gc",
+    dest="collect_garbage",
+    default=False,
+    action="store_true",
+    help="Remove files from the --store that no manifest refers to any "
+    "more, and that no backup used in the last day. Delete old manifests "
+    "first to free their files.",
+)
+
+parser.add_argument(
+    "--index",
+    dest="use_index",
+    default=False,
+    action="store_true",
+    help="Remember the URLs found in saves, so unchanged saves are not "
+    "parsed again.",
+)
+
+parser.add_argument(
+    "--parse-workers",
+    dest="parse_workers",
+    metavar="N",
+    type=int,
+    default=1,
+    help="Parse saves in N processes in parallel.",
+)
+
+parser.add_argument(
+    "--all",
+    "--library",
+    dest="library",
+    default=False,
+    action="store_true",
+    help="Process all saves and workshop mods in the game data directory.",
+)
+
+parser.add_argument(
+    "--include",
+    dest="include",
+    metavar="GLOB",
+    action="append",
+    default=[],
+    help="With --all, only process saves whose path within the game data "
+    "directory matches GLOB (say, 'Saves/*'). Can be given several times.",
+)
+
+parser.add_argument(
+    "--exclude",
+    dest="exclude",
+    metavar="GLOB",
+    action="append",
+    default=[],
+    help="With --all, skip saves whose path within the game data directory "
+    "matches GLOB. Can be given several times.",
+)
+
+parser.add_argument(
+    "--outdir",
+    dest="outdir_name",
+    metavar="PATH",
+    default=".",
+    help="With --all, the directory to write the archives to.",
+)
+
 
 def console_entry():
 
     args = parser.parse_args()
-    backup_json(args)
+    if args.delta and not args.base_name:
+        parser.error("--delta needs a --base archive.")
+    if args.library and args.infile_names:
+        parser.error("Give either the saves to back up, or --all.")
+    if len(args.infile_names) > 1 and not (
+        args.outfile_name or args.store_name
+    ):
+        parser.error("Give --outname to back up several saves.")
+    if args.collect_garbage and not args.store_name:
+        parser.error("--gc needs a --store.")
+    if args.store_name and args.base_name:
+        parser.error("--base cannot be used with --store.")
+    if args.library:
+        backup_library(args)
+    elif args.infile_names:
+        backup_json(args)
+    elif not args.collect_garbage:
+        parser.error("Give the saves to back up, or --all.")
+    if args.collect_garbage:
+        collect_store_garbage(args)
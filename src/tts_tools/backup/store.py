@@ -0,0 +1,261 @@
+from concurrent.futures import ThreadPoolExecutor
+from tts_tools.libtts import AssetTable
+from tts_tools.libtts import get_fs_paths
+from tts_tools.util import get_digest
+from tts_tools.util import get_member_name
+from tts_tools.util import print_err
+from tts_tools.util import REVISION
+
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+
+BLOBDIR = "blobs"
+MANIFESTDIR = "manifests"
+
+CHUNK_SIZE = 1024 * 1024
+
+# Temporary files are written next to the blobs, and renamed once
+# complete.
+TEMP_PREFIX = ".tmp-"
+
+# Garbage collection leaves files alone that were used this recently,
+# since a backup running at the same time may not have written the
+# manifest referring to them yet.
+GC_GRACE_PERIOD = 24 * 60 * 60
+
+
+class AssetStore:
+    """A directory holding files under the SHA-256 of their content, so
+    that each content is stored once, however many saves and backups
+    refer to it.
+
+    Blobs are kept in blobs/ab/abcdef…, and manifests, which map the
+    files of a save to their digests, in manifests/.
+
+    """
+
+    def __init__(self, store_dir, dry_run=False):
+
+        self.store_dir = os.path.abspath(store_dir)
+        self.blob_dir = os.path.join(self.store_dir, BLOBDIR)
+        self.manifest_dir = os.path.join(self.store_dir, MANIFESTDIR)
+        self.dry_run = dry_run
+
+    def blob_path(self, digest):
+
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def put(self, filename):
+        """Store the content of filename, unless it is stored already,
+        and return its digest.
+
+        """
+
+        digest = get_digest(filename)
+        blob_name = self.blob_path(digest)
+        if self.dry_run:
+            return digest
+
+        try:
+            # Mark the blob as used, see GC_GRACE_PERIOD.
+            os.utime(blob_name)
+            return digest
+        except FileNotFoundError:
+            pass
+
+        directory = os.path.dirname(blob_name)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                with open(filename, "rb") as infile:
+                    shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+            os.replace(temp_name, blob_name)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        return digest
+
+    def put_manifest(self, save_arcname, manifest):
+        """Store the manifest for a backup of a save, and return its file
+        name. Earlier manifests of the save are kept.
+
+        """
+
+        name = re.sub(r"\.json$", "", save_arcname)
+        directory = os.path.join(self.manifest_dir, *name.split("/"))
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        filename = os.path.join(directory, stamp + ".json")
+        if self.dry_run:
+            return filename
+
+        os.makedirs(directory, exist_ok=True)
+        # Backups of the same save within a second get numbered names.
+        for n in itertools.count(1):
+            try:
+                outfile = open(filename, "x", encoding="utf-8")
+            except FileExistsError:
+                filename = os.path.join(
+                    directory, "{}-{}.json".format(stamp, n)
+                )
+                continue
+            with outfile:
+                json.dump(manifest, outfile, indent=2)
+            return filename
+
+    def manifests(self):
+        "Yield the file names of all manifests."
+        for dirpath, dirnames, filenames in os.walk(self.manifest_dir):
+            for name in filenames:
+                if name.endswith(".json"):
+                    yield os.path.join(dirpath, name)
+
+    def blobs(self):
+        "Yield the file names of all blobs, including unfinished ones."
+        for dirpath, dirnames, filenames in os.walk(self.blob_dir):
+            for name in filenames:
+                yield os.path.join(dirpath, name)
+
+    def referenced(self):
+        """Return the digests referenced by any manifest. Raise ValueError
+        if a manifest cannot be read.
+
+        """
+
+        digests = set()
+        for filename in self.manifests():
+            with open(filename, "r", encoding="utf-8") as infile:
+                try:
+                    manifest = json.load(infile)
+                    digests.add(manifest["save"]["sha256"])
+                    digests.update(manifest["files"].values())
+                except (ValueError, KeyError, TypeError) as error:
+                    raise ValueError(
+                        "Malformed manifest {}: {}".format(filename, error)
+                    )
+        return digests
+
+    def collect_garbage(self, grace_period=GC_GRACE_PERIOD):
+        """Remove blobs that no manifest refers to, and unfinished ones,
+        unless they were used within grace_period seconds. Return the
+        names and sizes of the removed files.
+
+        """
+
+        referenced = self.referenced()
+        removed = []
+        for filename in self.blobs():
+            if os.path.basename(filename) in referenced:
+                continue
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                # A temporary file renamed in the meantime.
+                continue
+            if time.time() - stat.st_mtime < grace_period:
+                continue
+            size = stat.st_size
+            if not self.dry_run:
+                os.remove(filename)
+            removed.append((filename, size))
+        return removed
+
+
+def backup_to_store(args, savegames, save_arcnames, gamedata_dir):
+    """Store the saves and the files they refer to in the asset store
+    args.store_name, along with a manifest for each save.
+
+    """
+
+    store = AssetStore(args.store_name, dry_run=args.dry_run)
+    gamedata_dir = os.path.abspath(gamedata_dir)
+
+    # Each file is read once, however many saves refer to it.
+    assets = AssetTable()
+    save_files = [
+        get_fs_paths(assets.distinct(assets.extend(savegame.urls)))
+        for savegame in savegames
+    ]
+    filenames = dict.fromkeys(name for names in save_files for name in names)
+
+    def put(name):
+        filename = os.path.join(gamedata_dir, name)
+        try:
+            return filename, store.put(filename)
+        except FileNotFoundError:
+            return filename, None
+
+    digests = {}
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        for name, (filename, digest) in zip(
+            filenames, executor.map(put, filenames)
+        ):
+            if digest:
+                print(filename)
+            elif args.ignore_missing:
+                print("{} (not found)".format(filename))
+            else:
+                print_err(
+                    "Could not store {} (not found). Aborting.".format(
+                        filename
+                    )
+                )
+                executor.shutdown(cancel_futures=True)
+                sys.exit(1)
+            digests[name] = digest
+
+    for infile_name, savegame, names, arcname in zip(
+        args.infile_names, savegames, save_files, save_arcnames
+    ):
+        files = {}
+        for name in names:
+            if digests[name]:
+                files[get_member_name(name)] = digests[name]
+
+        manifest = dict(
+            script_revision=REVISION,
+            export_date=round(time.time()),
+            name=savegame.name,
+            save=dict(name=arcname, sha256=store.put(infile_name)),
+            files=files,
+        )
+        if args.comment:
+            manifest["comment"] = args.comment
+
+        filename = store.put_manifest(arcname, manifest)
+        if args.dry_run:
+            print("Dry run for {} completed.".format(infile_name))
+        else:
+            print(
+                "Backed-up contents for {file} found in {manifest}.".format(
+                    file=infile_name, manifest=filename
+                )
+            )
+
+
+def collect_store_garbage(args):
+    "Remove the blobs of the asset store args.store_name no save needs."
+
+    store = AssetStore(args.store_name, dry_run=args.dry_run)
+    try:
+        removed = store.collect_garbage()
+    except (OSError, ValueError) as error:
+        print_err("Could not collect garbage: {}".format(error))
+        sys.exit(1)
+
+    for filename, size in removed:
+        print(filename)
+    print(
+        "{verb} {count} unreferenced files ({size} bytes).".format(
+            verb="Would remove" if args.dry_run else "Removed",
+            count=len(removed),
+            size=sum(size for filename, size in removed),
+        )
+    )
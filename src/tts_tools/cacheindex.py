@@ -0,0 +1,96 @@
+import os
+import stat
+import threading
+
+
+class CacheIndex:
+    """The files in the cache directories of TTS, so that checking
+    whether an asset is cached needs no system call per asset.
+
+    Each directory is listed once with os.scandir when first asked
+    about. Files written afterwards should be passed to update().
+    Relative file names are taken relative to the gamedata directory.
+
+    """
+
+    def __init__(self, gamedata_dir):
+
+        self.gamedata_dir = os.path.abspath(gamedata_dir)
+        self.lock = threading.Lock()
+
+        # Directory → normalized file name → os.DirEntry from the
+        # listing, or os.stat_result from update().
+        self.dirs = {}
+
+    def split(self, filename):
+
+        filename = os.path.join(self.gamedata_dir, filename)
+        directory, name = os.path.split(filename)
+        return directory, os.path.normcase(name)
+
+    def list_dir(self, directory):
+        """Return the entries of directory by name. Call with the lock
+        held.
+
+        """
+
+        entries = self.dirs.get(directory)
+        if entries is None:
+            entries = {}
+            try:
+                with os.scandir(directory) as scan:
+                    for entry in scan:
+                        entries[os.path.normcase(entry.name)] = entry
+            except OSError:
+                pass
+            self.dirs[directory] = entries
+        return entries
+
+    def stat(self, filename):
+        """Return the stat result of filename, or None if it is not a
+        file.
+
+        """
+
+        directory, name = self.split(filename)
+        with self.lock:
+            entry = self.list_dir(directory).get(name)
+
+        if isinstance(entry, os.DirEntry):
+            # On most platforms, this needs no system call.
+            if not entry.is_file():
+                return None
+            try:
+                entry = entry.stat()
+            except OSError:
+                return None
+
+        if entry is None or not stat.S_ISREG(entry.st_mode):
+            return None
+        return entry
+
+    def isfile(self, filename):
+
+        directory, name = self.split(filename)
+        with self.lock:
+            entry = self.list_dir(directory).get(name)
+
+        if isinstance(entry, os.DirEntry):
+            return entry.is_file()
+        return entry is not None and stat.S_ISREG(entry.st_mode)
+
+    def update(self, filename):
+        """Record that filename has been written or removed."""
+
+        directory, name = self.split(filename)
+        try:
+            result = os.stat(os.path.join(directory, name))
+        except OSError:
+            result = None
+
+        with self.lock:
+            entries = self.list_dir(directory)
+            if result is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = result
@@ -0,0 +1,269 @@
+"""Incremental JSON parsing for files too large to load at once.
+
+iterparse() reads a JSON document in chunks and yields parse events,
+so that only the values of interest need to be kept in memory.
+
+"""
+
+from json.decoder import JSONDecodeError
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+
+import re
+
+
+START_MAP = "start_map"
+MAP_KEY = "map_key"
+END_MAP = "end_map"
+START_ARRAY = "start_array"
+END_ARRAY = "end_array"
+VALUE = "value"
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# The characters that may make up a number.
+NUMBER_CHARS = re.compile(r"[-+.\deE]*")
+
+# The constants accepted by json.load.
+CONSTANTS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "NaN": float("nan"),
+    "Infinity": float("inf"),
+    "-Infinity": float("-inf"),
+}
+CONSTANT_LENGTH = max(len(name) for name in CONSTANTS)
+
+
+class Reader:
+    """A buffered reader for the tokens of a JSON text file."""
+
+    def __init__(self, infile, chunk_size=CHUNK_SIZE):
+
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=0):
+        """Read at least size more characters, dropping those already
+        consumed. Return False at the end of the file.
+
+        """
+
+        if self.eof:
+            return False
+
+        start = self.pos
+        self.buf = self.buf[start:]
+        self.pos = 0
+
+        data = self.infile.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def ensure(self, count):
+        """Make count characters available past the current position,
+        unless the end of the file comes first.
+
+        """
+
+        while len(self.buf) - self.pos < count and self.fill():
+            pass
+
+    def peek(self):
+        """Skip whitespace and return the next character, or an empty
+        string at the end of the file.
+
+        """
+
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char, name):
+
+        if self.peek() != char:
+            self.error("Expecting {}".format(name))
+        self.pos += 1
+
+    def read_string(self):
+
+        while True:
+            try:
+                value, self.pos = scanstring(self.buf, self.pos + 1)
+                return value
+            except JSONDecodeError:
+                # The string may continue past the buffer. Growing the
+                # buffer by its own size keeps long strings linear.
+                if not self.fill(len(self.buf) - self.pos):
+                    raise
+
+    def read_key(self):
+
+        if self.peek() != '"':
+            self.error("Expecting property name enclosed in double quotes")
+        key = self.read_string()
+        self.expect(":", "':' delimiter")
+        return key
+
+    def read_scalar(self):
+
+        self.ensure(CONSTANT_LENGTH)
+        for name, value in CONSTANTS.items():
+            if self.buf.startswith(name, self.pos):
+                self.pos += len(name)
+                return value
+
+        # A number may continue past the buffer. Its prefix might still
+        # match on its own, so read on until the number is complete.
+        while True:
+            end = NUMBER_CHARS.match(self.buf, self.pos).end()
+            if end < len(self.buf) or not self.fill(len(self.buf) - self.pos):
+                break
+
+        match = NUMBER_RE.match(self.buf, self.pos)
+        if not match:
+            self.error("Expecting value")
+
+        self.pos = match.end()
+        integer, frac, exp = match.groups()
+        if frac or exp:
+            return float(integer + (frac or "") + (exp or ""))
+        return int(integer)
+
+    def error(self, msg):
+
+        raise JSONDecodeError(msg, self.buf, self.pos)
+
+
+def iterparse(infile, chunk_size=CHUNK_SIZE):
+    """Parse the JSON document in the text file infile, and yield events
+    of the form (event, value).
+
+    Mappings yield START_MAP, a MAP_KEY for every key followed by the
+    events of its value, and END_MAP. Arrays yield START_ARRAY, the
+    events of their elements, and END_ARRAY. Strings, numbers and
+    constants yield VALUE. value is None for all events except MAP_KEY
+    and VALUE.
+
+    Malformed documents raise JSONDecodeError, possibly after some
+    events have been yielded.
+
+    """
+
+    reader = Reader(infile, chunk_size)
+
+    # The kinds of the open containers, "{" or "[".
+    stack = []
+
+    while True:
+
+        char = reader.peek()
+
+        if char == "{":
+            reader.pos += 1
+            yield START_MAP, None
+            if reader.peek() != "}":
+                stack.append("{")
+                yield MAP_KEY, reader.read_key()
+                continue
+            reader.pos += 1
+            yield END_MAP, None
+
+        elif char == "[":
+            reader.pos += 1
+            yield START_ARRAY, None
+            if reader.peek() != "]":
+                stack.append("[")
+                continue
+            reader.pos += 1
+            yield END_ARRAY, None
+
+        elif char == '"':
+            yield VALUE, reader.read_string()
+
+        else:
+            yield VALUE, reader.read_scalar()
+
+        # A value is complete. Close the containers that end with it,
+        # up to the next element.
+        while True:
+
+            if not stack:
+                if reader.peek():
+                    reader.error("Extra data")
+                return
+
+            char = reader.peek()
+            if char == ",":
+                reader.pos += 1
+                if stack[-1] == "{":
+                    yield MAP_KEY, reader.read_key()
+                break
+
+            if stack.pop() == "{":
+                if char != "}":
+                    reader.error("Expecting ',' delimiter")
+                reader.pos += 1
+                yield END_MAP, None
+            else:
+                if char != "]":
+                    reader.error("Expecting ',' delimiter")
+                reader.pos += 1
+                yield END_ARRAY, None
+
+
+def skip_value(events, event):
+    """Consume the rest of the value that started with event."""
+
+    depth = 0
+    while True:
+        if event in (START_MAP, START_ARRAY):
+            depth += 1
+        elif event in (END_MAP, END_ARRAY):
+            depth -= 1
+        if not depth:
+            return
+        event, _ = next(events)
+
+
+def build_value(events, event, value):
+    """Consume the rest of the value that started with (event, value),
+    and return it as json.load would.
+
+    """
+
+    # Pairs of an open container and the key pending in it.
+    stack = []
+
+    while True:
+
+        if event == START_MAP:
+            stack.append(({}, None))
+        elif event == START_ARRAY:
+            stack.append(([], None))
+        elif event == MAP_KEY:
+            stack[-1] = (stack[-1][0], value)
+        else:
+            if event in (END_MAP, END_ARRAY):
+                value = stack.pop()[0]
+            if not stack:
+                return value
+            container, key = stack[-1]
+            if isinstance(container, list):
+                container.append(value)
+            else:
+                container[key] = value
+
+        event, value = next(events)
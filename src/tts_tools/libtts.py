@@ -1,3 +1,19 @@
+from array import array
+from collections import Counter
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
+from tts_tools.jsonstream import build_value
+from tts_tools.jsonstream import END_ARRAY
+from tts_tools.jsonstream import END_MAP
+from tts_tools.jsonstream import iterparse
+from tts_tools.jsonstream import MAP_KEY
+from tts_tools.jsonstream import skip_value
+from tts_tools.jsonstream import START_ARRAY
+from tts_tools.jsonstream import START_MAP
+
+import itertools
 import json
 import os
 import platform
@@ -10,6 +26,12 @@ BUNDLEPATH = os.path.join("Mods", "Assetbundles")
 AUDIOPATH = os.path.join("Mods", "Audio")
 PDFPATH = os.path.join("Mods", "PDF")
 
+SAVEPATH = "Saves"
+WORKSHOPPATH = os.path.join("Mods", "Workshop")
+
+# JSON files in the save directories that are not saves.
+SAVE_LIST_FILES = ("SaveFileInfos.json", "WorkshopFileInfos.json")
+
 gamedata_map = {
     "Windows": "~/Documents/My Games/Tabletop Simulator",
     "Darwin": "~/Library/Tabletop Simulator",  # MacOS
@@ -22,156 +44,634 @@ except KeyError:
     GAMEDATA_DEFAULT = os.path.expanduser(gamedata_map["Windows"])
 
 
+# Top-level entries of a save game that describe it.
+METADATA_KEYS = (
+    "SaveName",
+    "GameMode",
+    "GameType",
+    "Date",
+    "EpochTime",
+    "VersionNumber",
+)
+
+# In-band metadata in deck art URLs.
+CURLY_BRACES = re.compile(r"{.*}")
+
+# Saves larger than this (in bytes) are parsed incrementally.
+STREAM_THRESHOLD = 64 * 1024 * 1024
+
+SaveGame = namedtuple("SaveGame", ("filename", "name", "urls", "metadata"))
+
+
 class IllegalSavegameException(ValueError):
-    def __init__(self):
-        super().__init__("not a Tabletop Simulator savegame")
+    # The message is an argument, so that the exception can be pickled
+    # when raised in a worker process.
+    def __init__(self, msg="not a Tabletop Simulator savegame"):
+        super().__init__(msg)
 
 
 def seekURL(dic, trail=[]):
-    """Recursively search through the save game structure and return URLs
-    and the paths to them.
+    """Search through the save game structure and return URLs and the
+    paths to them.
+
+    """
+
+    # Paths are kept as linked (key, parent) nodes, so that nested
+    # mappings share their prefix, and are only turned into lists for
+    # the URLs found.
+    node = None
+    for k in trail:
+        node = (k, node)
+
+    # Iterators over the items still to be searched, along with the
+    # path to them.
+    stack = [(iter(dic.items()), node)]
+
+    while stack:
+
+        items, node = stack[-1]
+
+        for k, v in items:
+
+            if k == "AudioLibrary":
+                for elem in v:
+                    try:
+                        # It appears that AudioLibrary items are mappings
+                        # of form “Item1” → URL, “Item2” → audio title.
+                        yield (get_path(node, k), elem["Item1"])
+                    except KeyError:
+                        raise NotImplementedError(
+                            "AudioLibrary has unexpected structure: "
+                            "{}".format(v)
+                        )
+
+            elif isinstance(v, dict):
+                stack.append((iter(v.items()), (k, node)))
+                break
+
+            elif isinstance(v, list):
+                elems = (elem for elem in v if isinstance(elem, dict))
+                items = itertools.chain.from_iterable(
+                    elem.items() for elem in elems
+                )
+                stack.append((items, (k, node)))
+                break
+
+            elif k.lower().endswith("url"):
+                # We don’t want tablet URLs.
+                if k == "PageURL":
+                    continue
+
+                # Some URL keys may be left empty.
+                if not v:
+                    continue
+
+                # Deck art URLs can contain metadata in curly braces
+                # (yikes).
+                v = CURLY_BRACES.sub("", v)
+
+                yield (get_path(node, k), v)
+
+        else:
+            stack.pop()
+
+
+def get_path(node, k):
+    """Return the path to key k below a (key, parent) node as a list."""
+
+    path = [k]
+    while node:
+        k, node = node
+        path.append(k)
+    path.reverse()
+    return path
+
+
+def seek_url_events(events, metadata=None):
+    """Like seekURL, but search through the parse events of a save game
+    (see jsonstream.iterparse), keeping only the current path in memory.
+
+    If metadata is a dict, the top-level values for METADATA_KEYS are
+    stored in it along the way.
 
     """
 
-    for k, v in dic.items():
+    events = iter(events)
+
+    event, _ = next(events, (None, None))
+    if event != START_MAP:
+        raise IllegalSavegameException
+
+    trail = []
+
+    # For each open container, whether it is a list, and whether it
+    # added a key to trail.
+    frames = [(False, False)]
+
+    while frames:
+
+        event, value = next(events)
+        in_list, has_key = frames[-1]
+
+        if event in (END_MAP, END_ARRAY):
+            frames.pop()
+            if has_key:
+                trail.pop()
+            continue
 
-        newtrail = trail + [k]
+        if in_list:
+            # Lists are only searched for mappings.
+            if event == START_MAP:
+                frames.append((False, False))
+            else:
+                skip_value(events, event)
+            continue
+
+        assert event == MAP_KEY
+        k = value
+        event, v = next(events)
 
         if k == "AudioLibrary":
-            for elem in v:
+            if event == START_ARRAY:
+                elems = iter_array(events)
+            else:
+                elems = build_value(events, event, v)
+            for elem in elems:
                 try:
-                    # It appears that AudioLibrary items are mappings of form
-                    # “Item1” → URL, “Item2” → audio title.
-                    yield (newtrail, elem["Item1"])
+                    yield (trail + [k], elem["Item1"])
                 except KeyError:
                     raise NotImplementedError(
-                        "AudioLibrary has unexpected structure: {}".format(v)
+                        "AudioLibrary has unexpected structure: {}".format(
+                            elem
+                        )
                     )
 
-        elif isinstance(v, dict):
-            yield from seekURL(v, newtrail)
+        elif event == START_MAP:
+            trail.append(k)
+            frames.append((False, True))
 
-        elif isinstance(v, list):
-            for elem in v:
-                if not isinstance(elem, dict):
-                    continue
-                yield from seekURL(elem, newtrail)
+        elif event == START_ARRAY:
+            trail.append(k)
+            frames.append((True, True))
+
+        elif len(frames) == 1 and k in METADATA_KEYS:
+            if metadata is not None:
+                metadata[k] = v
 
         elif k.lower().endswith("url"):
-            # We don’t want tablet URLs.
             if k == "PageURL":
                 continue
-
-            # Some URL keys may be left empty.
             if not v:
                 continue
+            v = CURLY_BRACES.sub("", v)
+            yield (trail + [k], v)
+
+    # Check that nothing follows the save.
+    next(events, None)
+
+
+def iter_array(events):
+    """Yield the elements of an array whose START_ARRAY event has just
+    been consumed from events.
+
+    """
+
+    for event, value in events:
+        if event == END_ARRAY:
+            return
+        yield build_value(events, event, value)
 
-            # Deck art URLs can contain metadata in curly braces
-            # (yikes).
-            v = re.sub(r"{.*}", "", v)
 
-            yield (newtrail, v)
+# We need to tell whether a URL points to a mesh, an image, etc., so we
+# can do the right thing for each. This is decided by the key the URL
+# is found at.
 
+OBJ = "obj"
+BUNDLE = "bundle"
+AUDIO = "audio"
+PDF = "pdf"
+IMAGE = "image"
 
-# We need checks for whether a URL points to a mesh or an image, so we
-# can do the right thing for each.
+
+class AssetType:
+    """How assets of one kind are cached by TTS, and which content types
+    they may be served with.
+
+    mime_types are matched exactly, mime_prefixes by prefix.
+
+    """
+
+    def __init__(
+        self, kind, directory, suffix, mime_types=(), mime_prefixes=()
+    ):
+
+        self.kind = kind
+        self.directory = directory
+        self.suffix = suffix
+        self.mime_types = frozenset(mime_types)
+        self.mime_prefixes = tuple(mime_prefixes)
+
+    def get_suffix(self, url):
+
+        return self.suffix
+
+    def get_fs_path(self, url):
+
+        return os.path.join(
+            self.directory, recodeURL(url) + self.get_suffix(url)
+        )
+
+    def accepts(self, mime):
+
+        return mime in self.mime_types or mime.startswith(self.mime_prefixes)
+
+
+class ImageType(AssetType):
+    def get_suffix(self, url):
+
+        # TTS appears to perform some weird heuristics when determining
+        # the file suffix. ._.
+        if url.find(".png") > 0:
+            return ".png"
+        return ".jpg"
+
+
+OBJ_TYPE = AssetType(
+    OBJ,
+    OBJPATH,
+    ".obj",
+    mime_prefixes=(
+        "text/plain",
+        "application/binary",
+        "application/octet-stream",
+        "application/json",
+        "application/x-tgif",
+    ),
+)
+
+BUNDLE_TYPE = AssetType(
+    BUNDLE,
+    BUNDLEPATH,
+    ".unity3d",
+    mime_prefixes=("application/binary", "application/octet-stream"),
+)
+
+# Is the suffix always MP3, regardless of content?
+AUDIO_TYPE = AssetType(
+    AUDIO,
+    AUDIOPATH,
+    ".MP3",
+    mime_types=("application/octet-stream", "application/binary"),
+    mime_prefixes=("audio/",),
+)
+
+PDF_TYPE = AssetType(
+    PDF,
+    PDFPATH,
+    ".PDF",
+    mime_types=(
+        "application/pdf",
+        "application/binary",
+        "application/octet-stream",
+    ),
+)
+
+IMAGE_TYPE = ImageType(
+    IMAGE,
+    IMGPATH,
+    None,
+    mime_types=(
+        "image/jpeg",
+        "image/jpg",
+        "image/png",
+        "application/octet-stream",
+        "application/binary",
+        "video/mp4",
+    ),
+)
+
+# TODO: None of my mods have NormalURL set (normal maps?). I’m assuming
+# these are image files, like anything not listed here.
+ASSET_TYPES = {
+    "MeshURL": OBJ_TYPE,
+    "ColliderURL": OBJ_TYPE,
+    "AssetbundleURL": BUNDLE_TYPE,
+    "AssetbundleSecondaryURL": BUNDLE_TYPE,
+    "CurrentAudioURL": AUDIO_TYPE,
+    "AudioLibrary": AUDIO_TYPE,
+    "PDFUrl": PDF_TYPE,
+}
+
+
+# Characters TTS drops from URLs to name cached files.
+NON_WORD = re.compile(r"[\W_]")
+
+# Number of URLs for which file-system paths are remembered.
+PATH_CACHE_SIZE = 64 * 1024
+
+
+def get_asset_type(path, url):
+
+    return ASSET_TYPES.get(path[-1], IMAGE_TYPE)
 
 
 def is_obj(path, url):
-    # TODO: None of my mods have NormalURL set (normal maps?). I’m
-    # assuming these are image files.
-    obj_keys = ("MeshURL", "ColliderURL")
-    return path[-1] in obj_keys
+    return get_asset_type(path, url).kind == OBJ
 
 
 def is_image(path, url):
-    # This assumes that we only have mesh, assetbundle, audio, PDF and image
-    # URLs.
-    return not (
-        is_obj(path, url)
-        or is_assetbundle(path, url)
-        or is_audiolibrary(path, url)
-        or is_pdf(path, url)
-    )
+    return get_asset_type(path, url).kind == IMAGE
 
 
 def is_assetbundle(path, url):
-    bundle_keys = ("AssetbundleURL", "AssetbundleSecondaryURL")
-    return path[-1] in bundle_keys
+    return get_asset_type(path, url).kind == BUNDLE
 
 
 def is_audiolibrary(path, url):
-    audio_keys = ("CurrentAudioURL", "AudioLibrary")
-    return path[-1] in audio_keys
+    return get_asset_type(path, url).kind == AUDIO
 
 
 def is_pdf(path, url):
-    return path[-1] == "PDFUrl"
+    return get_asset_type(path, url).kind == PDF
+
+
+class AssetTable:
+    """A compact table of asset references, for plans over many saves.
+
+    Every reference is stored as three small integers in array columns:
+    the id of the key it was found at, the id of its URL, and its kind.
+    Keys and URLs are interned, so each distinct one is stored once.
+    Only the last key of each path is kept, which is all that decides
+    how an asset is handled.
+
+    """
+
+    kinds = (OBJ, BUNDLE, AUDIO, PDF, IMAGE)
+
+    def __init__(self, refs=()):
+
+        self.keys = []
+        self.key_ids = {}
+        self.urls = []
+        self.url_ids = {}
+
+        self.key_column = array("I")
+        self.url_column = array("I")
+        self.kind_column = array("B")
+
+        # The kind of an asset only depends on its key.
+        self.key_kinds = []
+
+        self.extend(refs)
+
+    def add(self, path, url):
+
+        key = path[-1]
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+            kind = get_asset_type(path, url).kind
+            self.key_kinds.append(self.kinds.index(kind))
+
+        url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = self.url_ids[url] = len(self.urls)
+            self.urls.append(url)
 
+        self.key_column.append(key_id)
+        self.url_column.append(url_id)
+        self.kind_column.append(self.key_kinds[key_id])
 
+    def extend(self, refs):
+        """Add refs, and return the range of rows they were added at."""
+
+        start = len(self)
+        for path, url in refs:
+            self.add(path, url)
+        return range(start, len(self))
+
+    def __len__(self):
+
+        return len(self.url_column)
+
+    def __iter__(self):
+        """Yield the references as (path, URL) pairs, with paths reduced
+        to their last key.
+
+        """
+
+        for key_id, url_id in zip(self.key_column, self.url_column):
+            yield ([self.keys[key_id]], self.urls[url_id])
+
+    def distinct(self, rows=None):
+        """Like __iter__, but yield each distinct reference only once,
+        and only those in rows if given.
+
+        """
+
+        if rows is None:
+            rows = range(len(self))
+
+        seen = set()
+        for row in rows:
+            ids = (self.key_column[row], self.url_column[row])
+            if ids in seen:
+                continue
+            seen.add(ids)
+            yield ([self.keys[ids[0]]], self.urls[ids[1]])
+
+    def count(self, kind=None):
+        """Return the number of references, or those of the given kind."""
+
+        if kind is None:
+            return len(self)
+        return self.kind_column.count(self.kinds.index(kind))
+
+    def count_by_kind(self):
+
+        counts = Counter(self.kind_column)
+        return {
+            kind: counts[kind_id]
+            for kind_id, kind in enumerate(self.kinds)
+            if counts[kind_id]
+        }
+
+    def group_by_kind(self):
+        """Return the distinct URLs of every kind, in the order they were
+        first added.
+
+        """
+
+        groups = {}
+        seen = set()
+        for kind_id, url_id in zip(self.kind_column, self.url_column):
+            if (kind_id, url_id) in seen:
+                continue
+            seen.add((kind_id, url_id))
+            kind = self.kinds[kind_id]
+            groups.setdefault(kind, []).append(self.urls[url_id])
+        return groups
+
+
+@lru_cache(maxsize=PATH_CACHE_SIZE)
 def recodeURL(url):
     """Recode the given URL in the way TTS does, which yields the
     file-system path to the cached file."""
 
-    return re.sub(r"[\W_]", "", url)
+    return NON_WORD.sub("", url)
 
 
 def get_fs_path(path, url):
     """Return a file-system path to the object in the cache."""
 
-    recoded_name = recodeURL(url)
+    return get_key_fs_path(path[-1], url)
 
-    if is_obj(path, url):
-        filename = recoded_name + ".obj"
-        return os.path.join(OBJPATH, filename)
 
-    elif is_assetbundle(path, url):
-        filename = recoded_name + ".unity3d"
-        return os.path.join(BUNDLEPATH, filename)
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def get_key_fs_path(key, url):
+    """Like get_fs_path, for a URL found at key."""
 
-    elif is_audiolibrary(path, url):
-        # Is the suffix always MP3, regardless of content?
-        filename = recoded_name + ".MP3"
-        return os.path.join(AUDIOPATH, filename)
+    return ASSET_TYPES.get(key, IMAGE_TYPE).get_fs_path(url)
 
-    elif is_pdf(path, url):
-        filename = recoded_name + ".PDF"
-        return os.path.join(PDFPATH, filename)
 
-    elif is_image(path, url):
-        # TTS appears to perform some weird heuristics when determining
-        # the file suffix. ._.
-        if url.find(".png") > 0:
-            file_suffix = ".png"
-        else:
-            file_suffix = ".jpg"
-        filename = recoded_name + file_suffix
-        return os.path.join(IMGPATH, filename)
+def get_fs_paths(refs):
+    """Return the file-system paths for a sequence of (path, URL)
+    pairs, in order.
+
+    """
+
+    return [get_key_fs_path(path[-1], url) for path, url in refs]
+
+
+def load_save(filename):
+    """Parse the save game filename once, and return it as a SaveGame
+    holding its name (None if missing), a list of (path, URL) pairs as
+    yielded by seekURL, and its metadata.
+
+    Saves larger than STREAM_THRESHOLD are parsed incrementally.
+
+    """
+
+    if os.path.getsize(filename) > STREAM_THRESHOLD:
+        metadata = {}
+        urls = list(stream_urls(filename, metadata))
 
     else:
-        errstr = (
-            "Do not know how to generate path for "
-            "URL {url} at {path}.".format(url=url, path=path)
-        )
-        raise ValueError(errstr)
+        with open(filename, "r", encoding="utf-8") as infile:
+            try:
+                save = json.load(infile)
+            except UnicodeDecodeError:
+                raise IllegalSavegameException
+
+        if not isinstance(save, dict):
+            raise IllegalSavegameException
+
+        urls = list(seekURL(save))
+        metadata = {key: save[key] for key in METADATA_KEYS if key in save}
+
+    return SaveGame(filename, metadata.get("SaveName"), urls, metadata)
+
+
+def load_saves(filenames, workers=1, return_errors=False):
+    """Like load_save, for several saves, and yield the SaveGames in the
+    order of filenames.
+
+    With several workers, saves are parsed by a pool of processes.
+    Errors loading a save are raised when its turn comes or, with
+    return_errors, yielded in place of its SaveGame, so that the
+    remaining saves can still be loaded.
+
+    """
+
+    load = try_load_save if return_errors else load_save
+
+    if workers <= 1:
+        for filename in filenames:
+            yield load(filename)
+        return
+
+    executor = ProcessPoolExecutor(workers)
+    try:
+        yield from executor.map(load, filenames)
+    finally:
+        # Don’t wait for the other saves when giving up early.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def try_load_save(filename):
+    """Like load_save, but return the error instead of raising it if the
+    save is missing or illegal.
+
+    """
+
+    try:
+        return load_save(filename)
+    except (FileNotFoundError, IllegalSavegameException) as error:
+        return error
+
+
+def find_saves(gamedata_dir, include=(), exclude=()):
+    """Return the saves and workshop mods in gamedata_dir, sorted by path.
+
+    include and exclude are glob patterns matched against paths relative
+    to gamedata_dir, using “/” as separator (say, “Saves/*”). If include
+    is given, only saves matching one of its patterns are returned.
+    Saves matching any pattern in exclude are skipped.
+
+    """
+
+    saves = []
+
+    for directory in (SAVEPATH, WORKSHOPPATH):
+        top = os.path.join(gamedata_dir, directory)
+        for dirpath, dirnames, filenames in os.walk(top):
+
+            dirnames.sort()
+            for name in sorted(filenames):
+
+                if not name.lower().endswith(".json"):
+                    continue
+                if name in SAVE_LIST_FILES:
+                    continue
+
+                filename = os.path.join(dirpath, name)
+                relname = os.path.relpath(filename, gamedata_dir)
+                relname = relname.replace(os.sep, "/")
+
+                if include and not any(
+                    fnmatch(relname, pattern) for pattern in include
+                ):
+                    continue
+                if any(fnmatch(relname, pattern) for pattern in exclude):
+                    continue
+
+                saves.append(filename)
+
+    return saves
 
 
 def urls_from_save(filename):
 
+    return load_save(filename).urls
+
+
+def stream_urls(filename, metadata=None):
+    """Like urls_from_save, but parse the save incrementally, so that
+    memory use does not grow with the size of the save.
+
+    This is slower than urls_from_save for saves that fit into memory
+    comfortably. Errors are raised during iteration.
+
+    """
+
     with open(filename, "r", encoding="utf-8") as infile:
         try:
-            save = json.load(infile)
+            yield from seek_url_events(iterparse(infile), metadata)
         except UnicodeDecodeError:
             raise IllegalSavegameException
 
-    if not isinstance(save, dict):
-        raise IllegalSavegameException
-
-    return seekURL(save)
-
 
 def get_save_name(filename):
 
-    with open(filename, "r", encoding="utf-8") as infile:
-        save = json.load(infile)
-    return save["SaveName"]
+    return load_save(filename).metadata["SaveName"]
@@ -1,27 +1,297 @@
+from collections import Counter
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
+from tts_tools.cacheindex import CacheIndex
+from tts_tools.libtts import AssetTable
+from tts_tools.libtts import find_saves
 from tts_tools.libtts import GAMEDATA_DEFAULT
+from tts_tools.libtts import get_asset_type
 from tts_tools.libtts import get_fs_path
-from tts_tools.libtts import get_save_name
 from tts_tools.libtts import IllegalSavegameException
-from tts_tools.libtts import is_assetbundle
-from tts_tools.libtts import is_audiolibrary
-from tts_tools.libtts import is_image
-from tts_tools.libtts import is_obj
-from tts_tools.libtts import is_pdf
-from tts_tools.libtts import urls_from_save
+from tts_tools.libtts import load_saves
+from tts_tools.prefetch.cache import classify_http_error
+from tts_tools.prefetch.cache import classify_url_error
+from tts_tools.prefetch.cache import DeadURLCache
+from tts_tools.prefetch.cache import UNREACHABLE
+from tts_tools.prefetch.cache import ValidatorIndex
+from tts_tools.prefetch.connection import ConnectionPool
+from tts_tools.prefetch.hosts import get_backoff_delay
+from tts_tools.prefetch.hosts import HostPolicy
+from tts_tools.prefetch.hosts import MAX_RETRY_DELAY
+from tts_tools.prefetch.hosts import parse_retry_after
+from tts_tools.prefetch.hosts import TRANSIENT_CODES
+from tts_tools.prefetch.report import Report
+from tts_tools.saveindex import SaveIndex
 from tts_tools.util import print_err
 
 import http.client
+import itertools
 import os
+import re
 import socket
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
-import urllib.request
 
 
-def prefetch_file(
-    filename,
+# A single download, as queued for the worker pool.
+FetchTask = namedtuple(
+    "FetchTask",
+    (
+        "url",
+        "fetch_url",
+        "outfile_name",
+        "asset_type",
+        "headers",
+    ),
+)
+
+# Outcomes of the assets in a prefetch plan.
+CACHED = "cached"
+DRY_RUN = "to fetch"
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not modified"
+FAILED = "failed"
+KNOWN_DEAD = "known dead"
+
+# Downloads are streamed to disk in chunks of this size.
+CHUNK_SIZE = 64 * 1024
+
+# Suffix for files that are still being downloaded.
+PART_SUFFIX = ".part"
+
+output_lock = threading.Lock()
+
+
+def log(*args, error=False, **kwargs):
+    """Print a message without interleaving it with output from other
+    workers.
+
+    """
+
+    with output_lock:
+        if error:
+            print_err(*args, **kwargs)
+        else:
+            print(*args, **kwargs)
+
+
+class Abort:
+    """Cancellation flag shared between the worker threads.
+
+    The GUI requests cancellation by releasing a semaphore once. Since
+    acquiring the semaphore consumes that release, we remember it so
+    that every worker checking afterwards sees it as well.
+
+    """
+
+    def __init__(self, semaphore=None):
+
+        self.semaphore = semaphore
+        self.event = threading.Event()
+
+    def is_set(self):
+
+        if self.event.is_set():
+            return True
+
+        if self.semaphore and self.semaphore.acquire(blocking=False):
+            self.event.set()
+            return True
+
+        return False
+
+    def set(self):
+
+        self.event.set()
+
+    def wait(self, timeout):
+        """Wait for up to timeout seconds. Return True if aborted in the
+        meantime.
+
+        """
+
+        deadline = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Poll, since the GUI’s semaphore cannot be waited on.
+            self.event.wait(min(remaining, 0.1))
+        return True
+
+
+class SaveSummary:
+    """A save in a prefetch plan, along with the rows of the plan's
+    asset table holding its references.
+
+    """
+
+    def __init__(self, filename, save_name, rows):
+
+        self.filename = filename
+        self.save_name = save_name
+        self.rows = rows
+
+
+class PrefetchPlan:
+    """The de-duplicated downloads for a batch of saves.
+
+    Downloads are keyed by their cache file, so every file is checked
+    and fetched only once, however many saves refer to it. The
+    references of all saves are kept in a single AssetTable.
+
+    """
+
+    def __init__(
+        self,
+        gamedata_dir,
+        cache_index,
+        validators,
+        dead_urls,
+        abort,
+        refetch=False,
+        dry_run=False,
+        retry_dead=False,
+        report=None,
+    ):
+
+        self.gamedata_dir = gamedata_dir
+        self.cache_index = cache_index
+        self.validators = validators
+        self.dead_urls = dead_urls
+        self.abort = abort
+        self.refetch = refetch
+        self.dry_run = dry_run
+        self.retry_dead = retry_dead
+        self.report = report
+
+        self.saves = []
+        self.assets = AssetTable()
+        self.tasks = {}
+        self.results = {}
+
+    def add_save(self, savegame):
+
+        filename = savegame.filename
+        save_name = savegame.name or "???"
+        print(
+            "Prefetching assets for {file} ({save_name}).".format(
+                file=filename, save_name=save_name
+            )
+        )
+
+        rows = self.assets.extend(savegame.urls)
+        self.saves.append(SaveSummary(filename, save_name, rows))
+
+        for path, url in self.assets.distinct(rows):
+
+            if self.abort.is_set():
+                return
+
+            asset_type = get_asset_type(path, url)
+            outfile_name = self.get_target(path, url)
+
+            # Several mods might share assets.
+            if outfile_name in self.tasks or outfile_name in self.results:
+                continue
+
+            kind = asset_type.kind
+
+            # Check if the object is already cached.
+            is_cached = self.cache_index.isfile(outfile_name)
+            if is_cached and not self.refetch:
+                self.set_result(outfile_name, url, kind, CACHED)
+                continue
+
+            # Don’t wait for URLs that failed recently.
+            failure = self.dead_urls.get_failure(url)
+            if failure and not self.retry_dead:
+                print_err(
+                    "{url}: Skipped, known to be dead ({failure})".format(
+                        url=url, failure=failure
+                    )
+                )
+                self.set_result(outfile_name, url, kind, KNOWN_DEAD)
+                continue
+
+            if self.dry_run:
+                print("{} dry run".format(url))
+                self.set_result(outfile_name, url, kind, DRY_RUN)
+                continue
+
+            # Some mods contain malformed URLs missing a prefix. I’m not
+            # sure how TTS deals with these. Let’s assume http for now.
+            if not urllib.parse.urlparse(url).scheme:
+                print_err(
+                    "Warning: URL {url} does not specify a URL scheme. "
+                    "Assuming http.".format(url=url)
+                )
+                fetch_url = "http://" + url
+            else:
+                fetch_url = url
+
+            # When refetching, only transfer content that has changed on
+            # the server.
+            headers = {}
+            if is_cached:
+                headers = self.validators.conditional_headers(
+                    url, outfile_name
+                )
+
+            self.tasks[outfile_name] = FetchTask(
+                url, fetch_url, outfile_name, asset_type, headers
+            )
+
+    def get_target(self, path, url):
+
+        return os.path.join(self.gamedata_dir, get_fs_path(path, url))
+
+    def summary(self, save):
+
+        targets = dict.fromkeys(
+            self.get_target(path, url)
+            for path, url in self.assets.distinct(save.rows)
+        )
+        counts = Counter(self.results.get(target) for target in targets)
+        details = ", ".join(
+            "{} {}".format(count, status)
+            for status, count in counts.items()
+            if status
+        )
+        msg = "{n} assets".format(n=len(targets))
+        if details:
+            msg += ": " + details
+        return msg
+
+    def set_result(self, outfile_name, url, kind, result):
+        """Record the outcome for an asset that is not downloaded."""
+
+        self.results[outfile_name] = result
+        if self.report:
+            self.report.add(
+                url=url,
+                host=urllib.parse.urlsplit(url).netloc,
+                kind=kind,
+                result=result,
+                cached=result == CACHED,
+            )
+
+
+def prefetch_file(filename, **kwargs):
+    """Prefetch the assets referenced by a single save. See
+    prefetch_saves for the keyword arguments.
+
+    """
+
+    prefetch_saves([filename], **kwargs)
+
+
+def prefetch_saves(
+    filenames,
     refetch=False,
     ignore_content_type=False,
     dry_run=False,
@@ -29,221 +299,560 @@ def prefetch_file(
     timeout=5,
     semaphore=None,
     user_agent="TTS prefetch",
+    jobs=1,
+    retries=0,
+    backoff=1,
+    rate=0,
+    max_host_failures=0,
+    retry_dead=False,
+    report_name=None,
+    use_index=False,
+    parse_workers=1,
 ):
+    """Prefetch the assets referenced by several saves.
+
+    All saves are read before downloading anything, so that assets
+    shared between them are only checked and fetched once.
+
+    """
+
+    abort = Abort(semaphore)
+    validators = ValidatorIndex(gamedata_dir)
+    dead_urls = DeadURLCache(gamedata_dir)
+    hosts = HostPolicy(rate=rate, max_failures=max_host_failures)
+    report = Report() if report_name else None
+
+    cache_index = CacheIndex(gamedata_dir)
+    plan = PrefetchPlan(
+        gamedata_dir,
+        cache_index,
+        validators,
+        dead_urls,
+        abort,
+        refetch=refetch,
+        dry_run=dry_run,
+        retry_dead=retry_dead,
+        report=report,
+    )
+
+    filenames = list(filenames)
+    save_index = None
+    if use_index:
+        save_index = SaveIndex(gamedata_dir)
+        savegames = save_index.load_saves(filenames, parse_workers)
+    else:
+        savegames = load_saves(filenames, parse_workers)
 
     try:
-        save_name = get_save_name(filename)
-    except Exception:
-        save_name = "???"
+        for filename in filenames:
+
+            try:
+                savegame = next(savegames)
+            except (FileNotFoundError, IllegalSavegameException) as error:
+                print_err(
+                    "Error retrieving URLs from {filename}: {error}".format(
+                        error=error, filename=filename
+                    )
+                )
+                raise
+
+            plan.add_save(savegame)
+            if abort.is_set():
+                # Downloads are skipped, but the report is written.
+                break
+
+    finally:
+        savegames.close()
+        if save_index:
+            save_index.close()
+
+    # Consecutive requests to the same host can reuse its connections.
+    tasks = sorted(
+        plan.tasks.values(),
+        key=lambda task: urllib.parse.urlsplit(task.fetch_url).netloc,
+    )
 
-    print(
-        "Prefetching assets for {file} ({save_name}).".format(
-            file=filename, save_name=save_name
-        )
+    jobs = max(jobs, 1)
+    pool = ConnectionPool(
+        timeout=timeout, user_agent=user_agent, max_idle=jobs
+    )
+
+    downloader = Downloader(
+        pool,
+        cache_index,
+        validators,
+        dead_urls,
+        hosts,
+        abort,
+        ignore_content_type=ignore_content_type,
+        retries=retries,
+        backoff=backoff,
+        report=report,
     )
 
     try:
-        urls = urls_from_save(filename)
-    except (FileNotFoundError, IllegalSavegameException) as error:
+        with pool, ThreadPoolExecutor(max_workers=jobs) as executor:
+
+            futures = [
+                executor.submit(downloader.fetch, task) for task in tasks
+            ]
+
+            # Collect results in order, so that errors which abort the
+            # run (e.g., unexpected content types) are raised here.
+            try:
+                for task, future in zip(tasks, futures):
+                    plan.results[task.outfile_name] = future.result()
+            except BaseException:
+                abort.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    finally:
+        # Only save once the workers have finished, since downloads that
+        # are interrupted still record how to resume them.
+        save_store(validators, "cache validators")
+        save_store(dead_urls, "dead URLs")
+
+        # Aborted and failed runs report what they did so far.
+        if report:
+            print(*report.summary(), sep="\n")
+            write_report(report, report_name)
+
+    if abort.is_set():
+        print("Aborted.")
+        return
+
+    if dry_run:
+        completion_msg = "Dry-run for {} completed ({})."
+    else:
+        completion_msg = "Prefetching {} completed ({})."
+    for save in plan.saves:
+        print(completion_msg.format(save.filename, plan.summary(save)))
+
+
+def write_report(report, report_name):
+
+    try:
+        report.write(report_name)
+    except OSError as error:
         print_err(
-            "Error retrieving URLs from {filename}: {error}".format(
-                error=error, filename=filename
+            "Could not write report to {file}: {error}".format(
+                file=report_name, error=error
             )
         )
-        raise
 
-    done = set()
-    for path, url in urls:
 
-        if semaphore and semaphore.acquire(blocking=False):
-            print("Aborted.")
-            return
+def save_store(store, contents):
 
-        # Some mods contain malformed URLs missing a prefix. I’m not
-        # sure how TTS deals with these. Let’s assume http for now.
-        if not urllib.parse.urlparse(url).scheme:
-            print_err(
-                "Warning: URL {url} does not specify a URL scheme. "
-                "Assuming http.".format(url=url)
+    try:
+        store.save()
+    except OSError as error:
+        print_err(
+            "Warning: Could not store {contents} in {file}: {error}".format(
+                contents=contents, file=store.filename, error=error
             )
-            fetch_url = "http://" + url
-        else:
-            fetch_url = url
-
-        # A mod might refer to the same URL multiple times.
-        if url in done:
-            continue
-
-        # To prevent downloading unexpected content, we check the MIME
-        # type in the response.
-        if is_obj(path, url):
-
-            def content_expected(mime):
-                return any(
-                    map(
-                        mime.startswith,
-                        (
-                            "text/plain",
-                            "application/binary",
-                            "application/octet-stream",
-                            "application/json",
-                            "application/x-tgif",
-                        ),
-                    )
-                )
+        )
+
+
+class DownloadError(Exception):
+    """A download failed.
+
+    If the failure is worth remembering in the cache of dead URLs,
+    failure names its class.
+
+    """
+
+    def __init__(self, msg, failure=None):
+
+        super().__init__(msg)
+        self.failure = failure
+
+
+class TransientError(DownloadError):
+    """A download failed for reasons that might go away when retrying."""
+
+    def __init__(self, msg, failure=None, retry_after=None):
+
+        super().__init__(msg, failure)
+        self.retry_after = retry_after
 
-        elif is_assetbundle(path, url):
 
-            def content_expected(mime):
-                return any(
-                    map(
-                        mime.startswith,
-                        ("application/binary", "application/octet-stream"),
+class Downloader:
+    """Downloads queued URLs into the cache.
+
+    A single downloader is shared by all worker threads.
+
+    """
+
+    def __init__(
+        self,
+        pool,
+        cache_index,
+        validators,
+        dead_urls,
+        hosts,
+        abort,
+        ignore_content_type=False,
+        retries=0,
+        backoff=1,
+        report=None,
+    ):
+
+        self.pool = pool
+        self.cache_index = cache_index
+        self.validators = validators
+        self.dead_urls = dead_urls
+        self.hosts = hosts
+        self.abort = abort
+        self.ignore_content_type = ignore_content_type
+        self.retries = retries
+        self.backoff = backoff
+        self.report = report
+
+    def fetch(self, task):
+        """Download a single queued URL and store it in the cache,
+        retrying on temporary failures.
+
+        Return the outcome, or None if the download was aborted.
+
+        """
+
+        host = urllib.parse.urlsplit(task.fetch_url).netloc
+        stats = dict(bytes=0, connect_time=0, ttfb=None)
+
+        start = time.monotonic()
+        result = self.retry(task, host, stats)
+
+        if self.report and result:
+            self.report.add(
+                url=task.url,
+                host=host,
+                kind=task.asset_type.kind,
+                result=result,
+                cached=result == NOT_MODIFIED,
+                total_time=time.monotonic() - start,
+                **stats,
+            )
+
+        return result
+
+    def retry(self, task, host, stats):
+
+        url = task.url
+        last_error = None
+        for attempt in itertools.count():
+
+            if self.hosts.is_broken(host):
+                if last_error:
+                    return self.fail(
+                        url,
+                        last_error,
+                        "too many failures on {}".format(host),
                     )
+                log(
+                    "{url}: Skipped, too many failures on {host}".format(
+                        url=url, host=host
+                    ),
+                    error=True,
                 )
+                return FAILED
+
+            if self.abort.is_set() or not self.hosts.wait(host, self.abort):
+                return None
+
+            try:
+                status = self.fetch_once(task, stats)
+
+            except TransientError as error:
+                last_error = error
+                self.hosts.record_failure(host)
+                if attempt >= self.retries:
+                    return self.fail(url, error)
+
+                delay = error.retry_after
+                if delay is not None and delay > MAX_RETRY_DELAY:
+                    return self.fail(
+                        url,
+                        error,
+                        "retry requested in {delay} s".format(delay=delay),
+                    )
 
-        elif is_image(path, url):
+                if delay is not None:
+                    self.hosts.defer(host, delay)
+                else:
+                    delay = get_backoff_delay(attempt, self.backoff)
 
-            def content_expected(mime):
-                return mime in (
-                    "image/jpeg",
-                    "image/jpg",
-                    "image/png",
-                    "application/octet-stream",
-                    "application/binary",
-                    "video/mp4",
+                log(
+                    "{url}: {error}, retrying in {delay:.1f} s".format(
+                        url=url, error=error, delay=delay
+                    ),
+                    error=True,
                 )
+                if error.retry_after is None and self.abort.wait(delay):
+                    return None
 
-        elif is_audiolibrary(path, url):
+            except DownloadError as error:
+                # The host did respond, after all.
+                self.hosts.record_success(host)
+                return self.fail(url, error)
 
-            def content_expected(mime):
-                return mime in (
-                    "application/octet-stream",
-                    "application/binary",
-                ) or mime.startswith("audio/")
+            else:
+                if status is not None:
+                    self.hosts.record_success(host)
+                    self.dead_urls.discard(url)
+                return status
 
-        elif is_pdf(path, url):
+    def fail(self, url, error, detail=None):
 
-            def content_expected(mime):
-                return mime in (
-                    "application/pdf",
-                    "application/binary",
-                    "application/octet-stream",
-                )
+        msg = "{url}: {error}".format(url=url, error=error)
+        if detail:
+            msg += ", " + detail
+        log(msg, error=True)
 
-        else:
-            errstr = "Do not know how to retrieve URL {url} at {path}.".format(
-                url=url, path=path
-            )
-            raise ValueError(errstr)
+        if error.failure:
+            self.dead_urls.record(url, error.failure)
+        return FAILED
 
-        outfile_name = os.path.join(gamedata_dir, get_fs_path(path, url))
+    def fetch_once(self, task, stats):
+        """Make one attempt at downloading a queued URL.
 
-        # Check if the object is already cached.
-        if os.path.isfile(outfile_name) and not refetch:
-            done.add(url)
-            continue
+        Return the outcome, or None if the download was aborted. Raise
+        DownloadError if the attempt fails, or TransientError if it
+        should be retried. Timings and sizes are added to stats.
 
-        print("{} ".format(url), end="", flush=True)
+        """
 
-        if dry_run:
-            print("dry run")
-            done.add(url)
-            continue
+        url = task.url
+        part_name = task.outfile_name + PART_SUFFIX
+        validators = self.validators
 
-        headers = {"User-Agent": user_agent}
-        request = urllib.request.Request(url=fetch_url, headers=headers)
+        # Continue where an earlier attempt left off, if possible.
+        offset, headers = validators.resume_headers(url, part_name)
+        headers.update(task.headers)
 
         try:
-            response = urllib.request.urlopen(request, timeout=timeout)
+            response = self.pool.get(task.fetch_url, headers)
 
         except urllib.error.HTTPError as error:
-            print_err(
-                "Error {code} ({reason})".format(
-                    code=error.code, reason=error.reason
-                )
+            if error.code == 416 and offset:
+                discard_partial(url, part_name, validators)
+                return self.fetch_once(task, stats)
+            msg = "Error {code} ({reason})".format(
+                code=error.code, reason=error.reason
             )
-            continue
+            failure = classify_http_error(error.code)
+            if error.code in TRANSIENT_CODES:
+                retry_after = parse_retry_after(
+                    error.headers.get("Retry-After")
+                )
+                raise TransientError(msg, failure, retry_after)
+            raise DownloadError(msg, failure)
+
+        except (ValueError, http.client.InvalidURL) as error:
+            # Retrying won’t fix the URL.
+            raise DownloadError("Invalid URL ({reason})".format(reason=error))
 
         except urllib.error.URLError as error:
-            print_err("Error ({reason})".format(reason=error.reason))
-            continue
+            raise TransientError(
+                "Error ({reason})".format(reason=error.reason),
+                classify_url_error(error),
+            )
 
         except socket.timeout as error:
-            print_err("Error ({reason})".format(reason=error))
-            continue
+            raise TransientError(
+                "Error ({reason})".format(reason=error), UNREACHABLE
+            )
 
         except http.client.HTTPException as error:
-            print_err("HTTP error ({reason})".format(reason=error))
-            continue
-
-        # Only for informative purposes.
-        length = response.getheader("Content-Length", 0)
-        length_kb = "???"
-        if length:
-            with suppress(ValueError):
-                length_kb = int(length) / 1000
-        size_msg = "({length} kb): ".format(length=length_kb)
-        print(size_msg, end="", flush=True)
-
-        content_type = response.getheader("Content-Type", "").strip()
-        is_expected = not content_type or content_expected(content_type)
-        if not (is_expected or ignore_content_type):
-            print_err(
-                "Error: Content type {type} does not match expected type. "
-                "Aborting. Use --relax to ignore.".format(type=content_type)
+            raise TransientError(
+                "HTTP error ({reason})".format(reason=error), UNREACHABLE
             )
-            sys.exit(1)
 
-        try:
-            with open(outfile_name, "wb") as outfile:
-                outfile.write(response.read())
+        stats["connect_time"] += response.connect_time
+        stats["ttfb"] = response.ttfb
+
+        with response:
+
+            if response.status == 304:
+                response.discard()
+                if offset:
+                    discard_partial(url, part_name, validators)
+                log("{url}: not modified".format(url=url))
+                return NOT_MODIFIED
+
+            if response.status == 206:
+                content_range = response.getheader("Content-Range", "")
+                if get_range_start(content_range) != offset:
+                    response.discard()
+                    discard_partial(url, part_name, validators)
+                    return self.fetch_once(task, stats)
+
+            # The server ignored the range, or the content has changed.
+            else:
+                offset = 0
+
+            # Only for informative purposes.
+            length = response.getheader("Content-Length", 0)
+            length_kb = "???"
+            if length:
+                with suppress(ValueError):
+                    length_kb = int(length) / 1000
+            if offset:
+                length_kb = "{} kb resumed at {}".format(
+                    length_kb, offset / 1000
+                )
 
-        except FileNotFoundError as error:
-            print_err("Error writing object to disk: {}".format(error))
-            raise
+            content_type = response.getheader("Content-Type", "").strip()
+            is_expected = not content_type or task.asset_type.accepts(
+                content_type
+            )
+            if not (is_expected or self.ignore_content_type):
+                log(
+                    "{url}: Error: Content type {type} does not match "
+                    "expected type. Aborting. Use --relax to ignore.".format(
+                        url=url, type=content_type
+                    ),
+                    error=True,
+                )
+                sys.exit(1)
 
-        # Don’t leave files with partial content lying around.
-        except Exception:
-            with suppress(FileNotFoundError):
-                os.remove(outfile_name)
-            raise
+            try:
+                size = store_response(
+                    response, part_name, task.outfile_name, self.abort, offset
+                )
 
-        else:
-            print("ok")
+            except DownloadInterrupted as error:
+                msg = "Error ({reason})".format(reason=error)
+                if validators.record_partial(url, response):
+                    msg += ", can be resumed"
+                else:
+                    discard_partial(url, part_name, validators)
+                raise TransientError(msg)
+
+            except FileNotFoundError as error:
+                log(
+                    "Error writing object to disk: {}".format(error),
+                    error=True,
+                )
+                raise
+
+            if size is None:
+                if not validators.record_partial(url, response):
+                    discard_partial(url, part_name, validators)
+                return None
+
+            self.cache_index.update(task.outfile_name)
+            validators.record(url, response, size)
+            stats["bytes"] = size - offset
+
+            log("{url} ({length} kb): ok".format(url=url, length=length_kb))
 
         if not is_expected:
             errmsg = (
                 "Warning: Content type {} did not match "
                 "expected type.".format(content_type)
             )
-            print_err(errmsg)
+            log(errmsg, error=True)
 
-        done.add(url)
+        return DOWNLOADED
 
-    if dry_run:
-        completion_msg = "Dry-run for {} completed."
-    else:
-        completion_msg = "Prefetching {} completed."
-    print(completion_msg.format(filename))
+
+class DownloadInterrupted(Exception):
+    """The connection failed before the response body was complete."""
+
+
+def store_response(response, part_name, outfile_name, abort, offset=0):
+    """Stream the body of response into the cache.
+
+    The body is written to the temporary file part_name, which is
+    renamed to outfile_name once complete, so the cache never contains
+    partial files. If offset is given, the body is appended to the
+    offset bytes already in part_name.
+
+    Return the total size of the file, or None if the download was
+    aborted. Raise DownloadInterrupted if the connection fails. In both
+    cases, the partial file is left in place.
+
+    """
+
+    size = offset
+
+    try:
+        with open(part_name, "ab" if offset else "wb") as outfile:
+            while True:
+                if abort.is_set():
+                    return None
+                try:
+                    chunk = response.read(CHUNK_SIZE)
+                except (OSError, http.client.HTTPException) as error:
+                    raise DownloadInterrupted(error)
+                if not chunk:
+                    break
+                outfile.write(chunk)
+                size += len(chunk)
+
+        os.replace(part_name, outfile_name)
+
+    except DownloadInterrupted:
+        raise
+
+    # Don’t leave files with partial content lying around.
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(part_name)
+        raise
+
+    return size
+
+
+def discard_partial(url, part_name, validators):
+
+    validators.forget_partial(url)
+    with suppress(FileNotFoundError):
+        os.remove(part_name)
+
+
+def get_range_start(content_range):
+    """Return the first byte position of a Content-Range header value, or
+    None if it cannot be parsed.
+
+    """
+
+    match = re.match(r"bytes\s+(\d+)-\d+/(\d+|\*)$", content_range.strip())
+    if match:
+        return int(match.group(1))
 
 
 def prefetch_files(args, semaphore=None):
 
-    for infile_name in args.infile_names:
+    filenames = list(args.infile_names)
+    if args.library:
+        filenames += find_saves(args.gamedata_dir, args.include, args.exclude)
+        if not filenames:
+            print_err("No saves found in {}.".format(args.gamedata_dir))
 
-        try:
-            prefetch_file(
-                infile_name,
-                dry_run=args.dry_run,
-                refetch=args.refetch,
-                ignore_content_type=args.ignore_content_type,
-                gamedata_dir=args.gamedata_dir,
-                timeout=args.timeout,
-                semaphore=semaphore,
-                user_agent=args.user_agent,
-            )
+    try:
+        prefetch_saves(
+            filenames,
+            dry_run=args.dry_run,
+            refetch=args.refetch,
+            ignore_content_type=args.ignore_content_type,
+            gamedata_dir=args.gamedata_dir,
+            timeout=args.timeout,
+            semaphore=semaphore,
+            user_agent=args.user_agent,
+            jobs=args.jobs,
+            retries=args.retries,
+            backoff=args.backoff,
+            rate=args.rate,
+            max_host_failures=args.max_host_failures,
+            retry_dead=args.retry_dead,
+            report_name=args.report_name,
+            use_index=args.use_index,
+            parse_workers=args.parse_workers,
+        )
 
-        except (FileNotFoundError, IllegalSavegameException, SystemExit):
-            print_err("Aborting.")
-            sys.exit(1)
+    except (FileNotFoundError, IllegalSavegameException, SystemExit):
+        print_err("Aborting.")
+        sys.exit(1)
@@ -0,0 +1,252 @@
+from tts_tools.prefetch.hosts import TRANSIENT_CODES
+
+import json
+import os
+import socket
+import threading
+import time
+
+
+# Classes of download failures, and how long to remember them.
+NOT_FOUND = "not found"
+HTTP_ERROR = "HTTP error"
+UNAVAILABLE = "unavailable"
+UNKNOWN_HOST = "unknown host"
+UNREACHABLE = "unreachable"
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+FAILURE_TTLS = {
+    NOT_FOUND: 7 * DAY,
+    HTTP_ERROR: DAY,
+    # Overloaded or failing servers usually recover soon.
+    UNAVAILABLE: HOUR,
+    UNKNOWN_HOST: DAY,
+    UNREACHABLE: HOUR,
+}
+
+# Resolver errors saying that a host does not exist. Others, such as
+# EAI_AGAIN without a network, may well pass.
+UNKNOWN_HOST_ERRORS = {
+    socket.EAI_NONAME,
+    getattr(socket, "EAI_NODATA", socket.EAI_NONAME),
+}
+
+
+class JSONStore:
+    """A small mapping that is persisted as a JSON file.
+
+    The file is read on creation and written back atomically by save().
+    Missing or unreadable files are treated as empty.
+
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = self.load()
+        self.dirty = False
+
+    def load(self):
+
+        try:
+            with open(self.filename, "r", encoding="utf-8") as infile:
+                entries = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def get(self, key):
+
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, value):
+
+        with self.lock:
+            self.entries[key] = value
+            self.dirty = True
+
+    def discard(self, key):
+
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+
+    def save(self):
+
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+
+        temp_name = self.filename + ".tmp"
+        with open(temp_name, "w", encoding="utf-8") as outfile:
+            outfile.write(data)
+        os.replace(temp_name, self.filename)
+
+
+class ValidatorIndex(JSONStore):
+    """Cache validators (ETag, Last-Modified) and sizes of downloaded
+    URLs, used to revalidate cached files instead of downloading them
+    again.
+
+    """
+
+    basename = "tts-prefetch-validators.json"
+
+    def __init__(self, gamedata_dir):
+
+        super().__init__(os.path.join(gamedata_dir, self.basename))
+
+    def conditional_headers(self, url, filename):
+        """Return request headers that revalidate the cached copy of url
+        stored at filename, or an empty dict if it cannot be revalidated.
+
+        """
+
+        entry = self.get(url)
+        if not entry:
+            return {}
+
+        # Only revalidate files that still are what we downloaded.
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return {}
+        if size != entry.get("size"):
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def resume_headers(self, url, part_name):
+        """Return the offset at which the partial download of url stored
+        at part_name can be resumed, along with the request headers to
+        do so.
+
+        """
+
+        entry = self.get(url) or {}
+        validator = entry.get("partial")
+        if not validator:
+            return 0, {}
+
+        try:
+            offset = os.path.getsize(part_name)
+        except OSError:
+            return 0, {}
+        if not offset:
+            return 0, {}
+
+        # Thanks to If-Range, the server sends the full content if it
+        # has changed in the meantime.
+        headers = {"Range": "bytes={}-".format(offset), "If-Range": validator}
+        return offset, headers
+
+    def record_partial(self, url, response):
+        """Remember the validator of an incomplete download of url, so it
+        can be resumed later. Return False if the response carries no
+        validator suitable for resuming.
+
+        """
+
+        # If-Range requires a strong validator.
+        etag = response.getheader("ETag")
+        if etag and not etag.startswith("W/"):
+            validator = etag
+        else:
+            validator = response.getheader("Last-Modified")
+
+        if not validator:
+            self.forget_partial(url)
+            return False
+
+        entry = dict(self.get(url) or {}, partial=validator)
+        self.set(url, entry)
+        return True
+
+    def forget_partial(self, url):
+
+        entry = self.get(url)
+        if entry and "partial" in entry:
+            entry = dict(entry)
+            del entry["partial"]
+            self.set(url, entry)
+
+    def record(self, url, response, size):
+        """Remember the validators sent along with a downloaded URL."""
+
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+
+        if etag or last_modified:
+            self.set(
+                url, dict(etag=etag, last_modified=last_modified, size=size)
+            )
+        else:
+            self.discard(url)
+
+
+class DeadURLCache(JSONStore):
+    """URLs that could not be downloaded recently, so we don’t wait for
+    them on every run.
+
+    How long a failure is remembered depends on its class.
+
+    """
+
+    basename = "tts-prefetch-dead.json"
+
+    def __init__(self, gamedata_dir):
+
+        super().__init__(os.path.join(gamedata_dir, self.basename))
+
+    def get_failure(self, url):
+        """Return the class of the last failure of url, or None if url is
+        not known to be dead.
+
+        """
+
+        entry = self.get(url)
+        if not entry:
+            return None
+
+        ttl = FAILURE_TTLS.get(entry.get("failure"), 0)
+        if time.time() - entry.get("time", 0) >= ttl:
+            self.discard(url)
+            return None
+
+        return entry["failure"]
+
+    def record(self, url, failure):
+
+        self.set(url, dict(failure=failure, time=round(time.time())))
+
+
+def classify_http_error(code):
+
+    if code in (404, 410):
+        return NOT_FOUND
+    if code in TRANSIENT_CODES:
+        return UNAVAILABLE
+    return HTTP_ERROR
+
+
+def classify_url_error(error):
+
+    reason = error.reason
+    if isinstance(reason, socket.gaierror):
+        if reason.errno in UNKNOWN_HOST_ERRORS:
+            return UNKNOWN_HOST
+    return UNREACHABLE
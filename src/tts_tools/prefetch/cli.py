@@ -13,7 +13,7 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "infile_names",
     metavar="FILENAME",
-    nargs="+",
+    nargs="*",
     help="The save file or mod in JSON format.",
 )
 
@@ -40,7 +40,8 @@ parser.add_argument(
     dest="refetch",
     default=False,
     action="store_true",
-    help="Rewrite objects that already exist in the cache.",
+    help="Rewrite objects that already exist in the cache, unless they "
+    "are unchanged on the server.",
 )
 
 parser.add_argument(
@@ -68,6 +69,112 @@ parser.add_argument(
     help="HTTP user-agent string.",
 )
 
+parser.add_argument(
+    "--jobs",
+    "-j",
+    dest="jobs",
+    default=1,
+    type=int,
+    help="Number of downloads to run in parallel.",
+)
+
+parser.add_argument(
+    "--retries",
+    dest="retries",
+    default=2,
+    type=int,
+    help="Number of retries after temporary download failures.",
+)
+
+parser.add_argument(
+    "--backoff",
+    dest="backoff",
+    metavar="SECONDS",
+    default=1.0,
+    type=float,
+    help="Initial delay before retrying, doubled with every retry.",
+)
+
+parser.add_argument(
+    "--rate",
+    dest="rate",
+    default=0,
+    type=float,
+    help="Maximum number of requests per second to a single host.",
+)
+
+parser.add_argument(
+    "--max-host-failures",
+    dest="max_host_failures",
+    metavar="N",
+    default=5,
+    type=int,
+    help="Skip hosts after N consecutive failures (0 to never skip).",
+)
+
+parser.add_argument(
+    "--retry-dead",
+    dest="retry_dead",
+    default=False,
+    action="store_true",
+    help="Also try URLs that are known to have failed recently.",
+)
+
+parser.add_argument(
+    "--report",
+    dest="report_name",
+    metavar="FILENAME",
+    default=None,
+    help="Write timings for every URL to a JSON (or .csv) file.",
+)
+
+parser.add_argument(
+    "--index",
+    dest="use_index",
+    default=False,
+    action="store_true",
+    help="Remember the URLs found in saves, so unchanged saves are not "
+    "parsed again.",
+)
+
+parser.add_argument(
+    "--parse-workers",
+    dest="parse_workers",
+    metavar="N",
+    type=int,
+    default=1,
+    help="Parse saves in N processes in parallel.",
+)
+
+parser.add_argument(
+    "--all",
+    "--library",
+    dest="library",
+    default=False,
+    action="store_true",
+    help="Process all saves and workshop mods in the game data directory.",
+)
+
+parser.add_argument(
+    "--include",
+    dest="include",
+    metavar="GLOB",
+    action="append",
+    default=[],
+    help="With --all, only process saves whose path within the game data "
+    "directory matches GLOB (say, 'Saves/*'). Can be given several times.",
+)
+
+parser.add_argument(
+    "--exclude",
+    dest="exclude",
+    metavar="GLOB",
+    action="append",
+    default=[],
+    help="With --all, skip saves whose path within the game data directory "
+    "matches GLOB. Can be given several times.",
+)
+
 
 def sigint_handler(signum, frame):
     sys.exit(1)
@@ -78,4 +185,6 @@ def console_entry():
     signal.signal(signal.SIGINT, sigint_handler)
     signal.signal(signal.SIGTERM, sigint_handler)
     args = parser.parse_args()
+    if not (args.infile_names or args.library):
+        parser.error("Give the saves to prefetch, or --all.")
     prefetch_files(args)
@@ -0,0 +1,340 @@
+import base64
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Connection failures which indicate that the server has closed an idle
+# keep-alive connection on its side.
+STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionAbortedError,
+    ConnectionResetError,
+)
+
+
+class ConnectionPool:
+    """HTTP/1.1 keep-alive connections, pooled per host.
+
+    A connection is used by one worker at a time and goes back to the
+    pool once its response has been read completely. Errors are raised
+    the way urllib.request.urlopen raises them, so callers can handle
+    both alike.
+
+    """
+
+    max_redirects = 10
+
+    # Error responses with bodies up to this size are read, so that
+    # their connection can be reused.
+    max_drain = 64 * 1024
+
+    def __init__(self, timeout=5, user_agent=None, max_idle=8):
+
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.max_idle = max_idle
+        self.proxies = urllib.request.getproxies()
+
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def close(self):
+
+        with self.lock:
+            idle, self.idle = self.idle, {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def get(self, url, headers=None):
+        """Issue a GET request for url and return the response, following
+        redirects.
+
+        Raise urllib.error.HTTPError for error responses, and ValueError
+        for URLs that cannot be requested, as urlopen does.
+
+        The response tells the time spent on connecting, and the time
+        until its headers arrived.
+
+        """
+
+        start = time.monotonic()
+        connect_time = 0
+
+        for _ in range(self.max_redirects + 1):
+
+            response = self.open(url, headers)
+            connect_time += response.connect_time
+            location = response.getheader("Location")
+
+            if response.status in REDIRECT_CODES and location:
+                response.discard()
+                url = urllib.parse.urljoin(url, location)
+
+            elif response.status >= 400:
+                response.discard()
+                raise urllib.error.HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.headers,
+                    None,
+                )
+
+            else:
+                response.connect_time = connect_time
+                response.ttfb = time.monotonic() - start
+                return response
+
+        raise urllib.error.HTTPError(
+            url, response.status, "Too many redirects", response.headers, None
+        )
+
+    def open(self, url, headers=None):
+        """Issue a single GET request for url on a pooled connection."""
+
+        key, target = self.route(url)
+
+        request_headers = {}
+        scheme, host, port, tunnel, proxy_auth = key
+        if proxy_auth and not tunnel:
+            request_headers["Proxy-Authorization"] = proxy_auth
+        if self.user_agent:
+            request_headers["User-Agent"] = self.user_agent
+        if headers:
+            request_headers.update(headers)
+
+        conn, reused = self.checkout(key)
+        try:
+            response, connect_time = self.send(conn, target, request_headers)
+
+        except STALE_ERRORS as error:
+            conn.close()
+            if not reused:
+                raise urllib.error.URLError(error)
+            # The server dropped the idle connection. Try once more on
+            # a fresh one.
+            conn = self.connect(key)
+            try:
+                response, connect_time = self.send(
+                    conn, target, request_headers
+                )
+            except STALE_ERRORS as error:
+                conn.close()
+                raise urllib.error.URLError(error)
+            except BaseException:
+                conn.close()
+                raise
+
+        except BaseException:
+            conn.close()
+            raise
+
+        response = PooledResponse(self, key, conn, response, url)
+        response.connect_time = connect_time
+        return response
+
+    def send(self, conn, target, headers):
+        """Send a request on conn. Return the response, along with the
+        time spent on connecting (including name resolution).
+
+        """
+
+        try:
+            start = time.monotonic()
+            if conn.sock is None:
+                conn.connect()
+            connect_time = time.monotonic() - start
+
+            conn.request("GET", target, headers=headers)
+            return conn.getresponse(), connect_time
+        except STALE_ERRORS:
+            raise
+        except OSError as error:
+            raise urllib.error.URLError(error)
+
+    def route(self, url):
+        """Return the pool key and the request target for url.
+
+        The key identifies the connection to use, which is either the
+        origin server itself or a proxy. It holds the scheme, host and
+        port to connect to, the origin to tunnel to through a proxy,
+        and the Proxy-Authorization for the proxy, if any.
+
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+
+        if scheme not in DEFAULT_PORTS:
+            raise ValueError("unknown url type: {}".format(scheme))
+        if not parts.hostname:
+            raise ValueError("no host given")
+
+        host = parts.hostname
+        port = parts.port or DEFAULT_PORTS[scheme]
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        proxy = self.proxies.get(scheme)
+        if proxy and not urllib.request.proxy_bypass(host):
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            proxy_scheme = proxy_parts.scheme or "http"
+            proxy_host = (
+                proxy_scheme,
+                proxy_parts.hostname,
+                proxy_parts.port or DEFAULT_PORTS.get(proxy_scheme, 80),
+            )
+            proxy_auth = get_proxy_auth(proxy_parts)
+            if scheme == "https":
+                return proxy_host + ((host, port), proxy_auth), target
+            absolute = urllib.parse.urlunsplit(
+                (scheme, parts.netloc, target, "", "")
+            )
+            return proxy_host + (None, proxy_auth), absolute
+
+        return (scheme, host, port, None, None), target
+
+    def checkout(self, key):
+        """Return an idle connection for key, or a new one.
+
+        The second return value tells whether the connection has been
+        used before.
+
+        """
+
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+
+        return self.connect(key), False
+
+    def connect(self, key):
+
+        scheme, host, port, tunnel, proxy_auth = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=self.timeout
+            )
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        if tunnel:
+            headers = {}
+            if proxy_auth:
+                headers["Proxy-Authorization"] = proxy_auth
+            conn.set_tunnel(*tunnel, headers=headers)
+        return conn
+
+    def release(self, key, conn):
+
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+
+        conn.close()
+
+
+def get_proxy_auth(proxy_parts):
+    """Return the Proxy-Authorization for the credentials in a split
+    proxy URL, like urllib.request.ProxyHandler, or None without any.
+
+    """
+
+    if not (proxy_parts.username and proxy_parts.password):
+        return None
+
+    user_pass = "{}:{}".format(
+        urllib.parse.unquote(proxy_parts.username),
+        urllib.parse.unquote(proxy_parts.password),
+    )
+    creds = base64.b64encode(user_pass.encode()).decode("ascii")
+    return "Basic " + creds
+
+
+class PooledResponse:
+    """An HTTP response whose connection goes back to the pool once it is
+    closed after reading the full body.
+
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+
+        self.url = url
+        self.connect_time = 0
+        self.ttfb = None
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def getheader(self, name, default=None):
+
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+
+        data = self.response.read(amt)
+
+        # http.client only detects truncated bodies when reading them as
+        # a whole.
+        if amt and not data and self.response.length:
+            raise http.client.IncompleteRead(b"", self.response.length)
+
+        return data
+
+    def close(self):
+
+        if self.conn is None:
+            return
+
+        conn, self.conn = self.conn, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, conn)
+        else:
+            self.response.close()
+            conn.close()
+
+    def discard(self):
+        """Close the response without using its body."""
+
+        length = self.response.length
+        if length is not None and length <= self.pool.max_drain:
+            try:
+                self.response.read()
+            except (OSError, http.client.HTTPException):
+                pass
+        self.close()
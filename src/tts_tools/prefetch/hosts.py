@@ -0,0 +1,102 @@
+from email.utils import parsedate_to_datetime
+
+import random
+import threading
+import time
+
+
+# HTTP status codes that indicate a temporary problem on the server.
+TRANSIENT_CODES = (408, 429, 500, 502, 503, 504)
+
+# Never wait longer than this before retrying a request.
+MAX_RETRY_DELAY = 60
+
+
+class HostPolicy:
+    """Request pacing and failure tracking per host.
+
+    Requests to a host are spaced according to a maximum request rate,
+    and can be deferred when the host asks us to back off. After a
+    number of consecutive failures, the circuit breaker for a host
+    opens, and no further requests are sent to it.
+
+    """
+
+    def __init__(self, rate=0, max_failures=0):
+
+        self.interval = 1 / rate if rate else 0
+        self.max_failures = max_failures
+
+        self.lock = threading.Lock()
+        self.next_slot = {}
+        self.failures = {}
+
+    def wait(self, host, abort):
+        """Wait until the next request to host may be sent. Return False
+        if aborted in the meantime.
+
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        delay = slot - now
+        return not (delay > 0 and abort.wait(delay))
+
+    def defer(self, host, delay):
+        """Send no requests to host for the next delay seconds."""
+
+        with self.lock:
+            slot = time.monotonic() + delay
+            self.next_slot[host] = max(slot, self.next_slot.get(host, slot))
+
+    def is_broken(self, host):
+
+        if not self.max_failures:
+            return False
+        with self.lock:
+            return self.failures.get(host, 0) >= self.max_failures
+
+    def record_success(self, host):
+
+        with self.lock:
+            self.failures.pop(host, None)
+
+    def record_failure(self, host):
+
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+
+
+def get_backoff_delay(attempt, backoff):
+    """Return a randomized delay before retry number attempt (counting
+    from zero), growing exponentially from backoff seconds.
+
+    """
+
+    delay = min(backoff * 2**attempt, MAX_RETRY_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header
+    value, or None if it cannot be parsed.
+
+    """
+
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        return None
+    return max(date.timestamp() - time.time(), 0)
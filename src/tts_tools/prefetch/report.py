@@ -0,0 +1,112 @@
+import csv
+import json
+import threading
+import time
+
+
+class Report:
+    """Timing and throughput records for the URLs of a prefetch run.
+
+    Records are written as CSV if the report file name ends in .csv,
+    and as JSON (including the run totals) otherwise.
+
+    """
+
+    fields = (
+        "url",
+        "host",
+        "kind",
+        "result",
+        "cached",
+        "bytes",
+        "connect_time",
+        "ttfb",
+        "total_time",
+    )
+
+    # Number of hosts listed in the totals.
+    slowest_count = 5
+
+    def __init__(self):
+
+        self.records = []
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+
+    def add(self, **record):
+
+        record = dict(dict.fromkeys(self.fields), **record)
+        with self.lock:
+            self.records.append(record)
+
+    def totals(self):
+
+        wall_time = time.monotonic() - self.start
+        fetched = [record for record in self.records if record["total_time"]]
+        total_bytes = sum(record["bytes"] or 0 for record in fetched)
+
+        results = {}
+        for record in self.records:
+            results[record["result"]] = results.get(record["result"], 0) + 1
+
+        hosts = {}
+        for record in fetched:
+            times = hosts.setdefault(record["host"], [])
+            times.append(record["total_time"])
+        slowest = sorted(
+            (
+                dict(
+                    host=host,
+                    requests=len(times),
+                    mean_time=sum(times) / len(times),
+                )
+                for host, times in hosts.items()
+            ),
+            key=lambda host: host["mean_time"],
+            reverse=True,
+        )
+
+        return dict(
+            urls=len(self.records),
+            results=results,
+            bytes=total_bytes,
+            wall_time=wall_time,
+            throughput=total_bytes / wall_time if wall_time else 0,
+            slowest_hosts=slowest[: self.slowest_count],
+        )
+
+    def summary(self):
+        """Return the run totals as lines of text."""
+
+        totals = self.totals()
+        lines = [
+            "Fetched {kb:.1f} kb in {time:.1f} s ({rate:.1f} kb/s).".format(
+                kb=totals["bytes"] / 1000,
+                time=totals["wall_time"],
+                rate=totals["throughput"] / 1000,
+            )
+        ]
+        if totals["slowest_hosts"]:
+            lines.append("Slowest hosts:")
+        for host in totals["slowest_hosts"]:
+            lines.append(
+                "  {host}: {mean_time:.2f} s per request "
+                "({requests} requests)".format(**host)
+            )
+        return lines
+
+    def write(self, filename):
+
+        with self.lock:
+            records = sorted(self.records, key=lambda record: record["url"])
+
+        if filename.lower().endswith(".csv"):
+            with open(filename, "w", newline="", encoding="utf-8") as outfile:
+                writer = csv.DictWriter(outfile, self.fields)
+                writer.writeheader()
+                writer.writerows(records)
+
+        else:
+            report = dict(records=records, totals=self.totals())
+            with open(filename, "w", encoding="utf-8") as outfile:
+                json.dump(report, outfile, indent=2)
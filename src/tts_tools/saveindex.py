@@ -0,0 +1,168 @@
+from contextlib import suppress
+from tts_tools.libtts import load_saves
+from tts_tools.libtts import SaveGame
+from tts_tools.util import get_digest
+from tts_tools.util import print_err
+
+import json
+import os
+import sqlite3
+
+
+class SaveIndex:
+    """A persistent index of the URLs found in save games, so that
+    unchanged saves need not be parsed again.
+
+    Entries are keyed by the absolute path of a save, and hold its size,
+    modification time and content hash. A save whose size and mtime
+    still match is taken from the index. If only its mtime differs, its
+    hash decides. Anything else is parsed anew and replaces the entry.
+    Saves are only hashed when stored, or when their mtime changed.
+
+    If the index cannot be opened or used, for instance because another
+    run holds a lock on it, saves are simply parsed every time.
+
+    """
+
+    basename = "tts-save-index.sqlite"
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS saves (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            name TEXT,
+            metadata TEXT NOT NULL,
+            urls TEXT NOT NULL
+        )
+    """
+
+    def __init__(self, gamedata_dir):
+
+        self.filename = os.path.join(gamedata_dir, self.basename)
+        try:
+            self.connection = sqlite3.connect(self.filename)
+            with self.connection:
+                self.connection.execute(self.schema)
+        except sqlite3.Error as error:
+            print_err(
+                "Warning: Could not open save index {filename}: "
+                "{error}".format(filename=self.filename, error=error)
+            )
+            self.connection = None
+
+    def load_save(self, filename):
+        """Like libtts.load_save, but use the index where possible."""
+
+        return next(self.load_saves([filename]))
+
+    def load_saves(self, filenames, workers=1, return_errors=False):
+        """Like libtts.load_saves, but use the index where possible."""
+
+        if self.connection is None:
+            yield from load_saves(filenames, workers, return_errors)
+            return
+
+        filenames = list(filenames)
+        indexed = {filename: self.lookup(filename) for filename in filenames}
+        parsed = load_saves(
+            [filename for filename in filenames if not indexed[filename]],
+            workers,
+            return_errors,
+        )
+
+        for filename in filenames:
+            savegame = indexed[filename]
+            if not savegame:
+                savegame = next(parsed)
+                if isinstance(savegame, SaveGame):
+                    self.store(savegame)
+            yield savegame
+
+    def lookup(self, filename):
+        """Return the indexed SaveGame for filename, or None if there is
+        none for its current contents.
+
+        """
+
+        path = os.path.abspath(filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        if self.connection is None:
+            return None
+
+        try:
+            row = self.connection.execute(
+                "SELECT size, mtime, hash, name, metadata, urls FROM saves "
+                "WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if not row:
+                return None
+
+            size, mtime, digest, name, metadata, urls = row
+            if size != stat.st_size:
+                return None
+
+            if mtime != stat.st_mtime_ns:
+                if get_digest(path) != digest:
+                    return None
+                with self.connection:
+                    self.connection.execute(
+                        "UPDATE saves SET mtime = ? WHERE path = ?",
+                        (stat.st_mtime_ns, path),
+                    )
+
+        except sqlite3.Error as error:
+            self.disable(error)
+            return None
+
+        urls = [(keys, url) for keys, url in json.loads(urls)]
+        return SaveGame(filename, name, urls, json.loads(metadata))
+
+    def store(self, savegame):
+
+        if self.connection is None:
+            return
+
+        path = os.path.abspath(savegame.filename)
+        stat = os.stat(path)
+
+        try:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO saves "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        get_digest(path),
+                        savegame.name,
+                        json.dumps(savegame.metadata),
+                        json.dumps(savegame.urls),
+                    ),
+                )
+        except sqlite3.Error as error:
+            self.disable(error)
+
+    def disable(self, error):
+        """Stop using the index after an error, and parse saves instead."""
+
+        print_err(
+            "Warning: Could not use save index {filename}: {error}".format(
+                filename=self.filename, error=error
+            )
+        )
+        self.close()
+
+    def close(self):
+
+        if self.connection is not None:
+            with suppress(sqlite3.Error):
+                self.connection.close()
+            self.connection = None
@@ -1,8 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import collections
+import hashlib
 import json
 import os
 import pkg_resources
+import struct
 import time
 import zipfile
+import zlib
 
 
 REVISION = pkg_resources.require("tts-backup")[0].version
@@ -27,6 +34,15 @@ class ShadowProxy:
         return getattr(self.__target, name)
 
 
+# Members larger than this are not compressed by workers, but written
+# directly, so as not to keep them in memory.
+MAX_BUFFERED_SIZE = 32 * 1024 * 1024
+
+# Chunk size for checksumming files and copying members between
+# archives.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
 class ZipFile(zipfile.ZipFile):
     """A ZipFile that supports dry-runs.
 
@@ -34,30 +50,77 @@ class ZipFile(zipfile.ZipFile):
     once. ZipFile.filelist would have been useful for this, but on
     Windows, this doesn’t seem to reflect writes before syncing the
     file to disk.
+
+    With several jobs, files are read and compressed by a pool of
+    threads, and appended to the archive in the order they were passed
+    to write().
+
+    Relative file names are taken relative to root, if given, and stored
+    under that name, so the working directory needn’t be changed.
+
+    Given a base archive opened for reading, files that are unchanged
+    since they were stored in it are copied from it without compressing
+    them again or, for a delta archive, left out.
     """
 
-    def __init__(self, *args, dry_run=False, ignore_missing=False, **kwargs):
+    def __init__(
+        self,
+        *args,
+        dry_run=False,
+        ignore_missing=False,
+        root=None,
+        cache_index=None,
+        jobs=1,
+        base=None,
+        delta=False,
+        **kwargs
+    ):
 
         self.dry_run = dry_run
         self.stored_files = set()
         self.ignore_missing = ignore_missing
+        self.root = os.path.abspath(root) if root else None
+        self.cache_index = cache_index
+        self.base = base
+        self.delta = delta
+        self.unchanged_count = 0
+
+        self.executor = None
+        self.pending = collections.deque()
+        self.max_pending = 2 * jobs
 
         if not self.dry_run:
             super().__init__(*args, **kwargs)
+            if jobs > 1:
+                self.executor = ThreadPoolExecutor(max_workers=jobs)
+
+    def __exit__(self, exc_type, *args, **kwargs):
 
-    def __exit__(self, *args, **kwargs):
+        if exc_type:
+            # Don’t bother finishing the remaining members.
+            for future, *_ in self.pending:
+                future.cancel()
+            self.pending.clear()
 
         if not self.dry_run:
-            super().__exit__(*args, **kwargs)
+            super().__exit__(exc_type, *args, **kwargs)
 
-    def write(self, filename, *args, **kwargs):
+    def write(
+        self, filename, arcname=None, compress_type=None, compresslevel=None
+    ):
 
         if filename in self.stored_files:
             return
 
+        if arcname is None:
+            arcname = filename
+        if self.root:
+            source = os.path.join(self.root, filename)
+        else:
+            source = filename
+
         # Logging.
-        curdir = os.getcwd()
-        absname = os.path.join(curdir, filename)
+        absname = os.path.abspath(source)
 
         def log_skipped():
             print("{} (not found)".format(absname))
@@ -65,25 +128,203 @@ class ZipFile(zipfile.ZipFile):
         def log_written():
             print(absname)
 
-        if not (os.path.isfile(filename) or self.ignore_missing):
+        def log_unchanged():
+            print("{} (unchanged)".format(absname))
+
+        if self.cache_index:
+            is_file = self.cache_index.isfile(source)
+        else:
+            is_file = os.path.isfile(source)
+
+        if not (is_file or self.ignore_missing):
             raise FileNotFoundError("No such file: {}".format(filename))
 
-        if self.dry_run and os.path.isfile(filename):
+        if compress_type is None:
+            compress_type = getattr(self, "compression", zipfile.ZIP_STORED)
+        if compresslevel is None:
+            compresslevel = getattr(self, "compresslevel", None)
+
+        base_info = None
+        if is_file and self.base:
+            base_info = self.find_unchanged(source, arcname)
+            if base_info and not self.delta:
+                # Recompress members if a different method was asked for.
+                if base_info.compress_type != compress_type:
+                    base_info = None
+
+        if base_info:
+            self.unchanged_count += 1
+
+        if self.dry_run and base_info:
+            log_unchanged()
+
+        elif self.dry_run and is_file:
             log_written()
 
         elif self.dry_run:
             log_skipped()
 
+        elif base_info and self.delta:
+            log_unchanged()
+
+        elif base_info:
+            write_member = partial(self.copy_member, base_info)
+            self.pending.append((None, write_member, log_unchanged, None))
+            self.flush(self.max_pending if self.executor else 0)
+
         else:
+            args = (source, arcname, compress_type, compresslevel)
+            write_member = partial(zipfile.ZipFile.write, self, *args)
+
+            if self.executor:
+                future = self.executor.submit(compress_file, *args)
+            else:
+                future = None
+            self.pending.append(
+                (future, write_member, log_written, log_skipped)
+            )
+            self.flush(self.max_pending if self.executor else 0)
+
+        self.stored_files.add(filename)
+
+    def flush(self, limit=0):
+        """Append pending members to the archive in order, until no more
+        than limit are left.
+
+        """
+
+        while len(self.pending) > limit:
+
+            entry = self.pending.popleft()
+            future, write_member, log_written, log_skipped = entry
             try:
-                super().write(filename, *args, **kwargs)
+                member = future.result() if future else None
+                if member:
+                    self.write_raw(*member)
+                else:
+                    write_member()
             except FileNotFoundError:
-                assert self.ignore_missing
+                if not self.ignore_missing:
+                    raise
                 log_skipped()
             else:
                 log_written()
 
-        self.stored_files.add(filename)
+    def writestr(self, zinfo_or_arcname, data, *args, **kwargs):
+
+        if self.dry_run:
+            return
+        self.flush()
+        super().writestr(zinfo_or_arcname, data, *args, **kwargs)
+
+    def find_unchanged(self, filename, arcname=None):
+        """Return the ZipInfo of the member of the base archive that
+        holds the current content of filename, or None.
+
+        Files that differ in size are changed. Files of the same size
+        whose modification time differs from the member’s are compared
+        by their CRC.
+
+        """
+
+        base_info = self.base.NameToInfo.get(
+            get_member_name(filename, arcname)
+        )
+        if base_info is None or base_info.flag_bits & 0x01:
+            # Not in the base archive, or encrypted.
+            return None
+
+        if self.cache_index:
+            stat = self.cache_index.stat(filename)
+        else:
+            stat = os.stat(filename)
+        if stat is None or base_info.file_size != stat.st_size:
+            return None
+
+        date_time = time.localtime(stat.st_mtime)[0:6]
+        # Zip archives store times with a resolution of two seconds.
+        date_time = date_time[0:5] + (date_time[5] // 2 * 2,)
+        if base_info.date_time == date_time:
+            return base_info
+
+        if get_crc(filename) == base_info.CRC:
+            return base_info
+        return None
+
+    def copy_member(self, base_info):
+        """Append a member of the base archive, copying its compressed
+        data as it is.
+
+        """
+
+        zinfo = zipfile.ZipInfo(base_info.filename, base_info.date_time)
+        zinfo.compress_type = base_info.compress_type
+        zinfo.CRC = base_info.CRC
+        zinfo.file_size = base_info.file_size
+        zinfo.compress_size = base_info.compress_size
+        zinfo.external_attr = base_info.external_attr
+        zinfo.create_system = base_info.create_system
+        # Sizes go into the local header, not into a data descriptor.
+        zinfo.flag_bits = base_info.flag_bits & ~0x08
+
+        self.write_raw(zinfo, read_raw(self.base, base_info))
+
+    # write_raw, compress_file and read_raw rely on private parts of
+    # zipfile (_writecheck, _lock, _writing, start_dir, _didModify,
+    # _get_compressor and the _FH_* header fields), since it offers no
+    # public way to handle compressed member data. test_util checks the
+    # archives they write with testzip(); run it on new Python versions.
+    def write_raw(self, zinfo, data):
+        """Append a member whose data has already been compressed.
+
+        zinfo must hold the final CRC, sizes and compression type. data
+        may be given as bytes, or as an iterable of bytes.
+
+        """
+
+        if isinstance(data, bytes):
+            data = (data,)
+
+        zip64 = (
+            zinfo.file_size > zipfile.ZIP64_LIMIT
+            or zinfo.compress_size > zipfile.ZIP64_LIMIT
+        )
+        if zip64 and not self._allowZip64:
+            raise zipfile.LargeZipFile(
+                "Filesize would require ZIP64 extensions"
+            )
+
+        with self._lock:
+            if self._writing:
+                raise ValueError(
+                    "Can't write to the ZIP file while there is another "
+                    "write handle open on it."
+                )
+
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+
+            self._writecheck(zinfo)
+            self._didModify = True
+
+            self.fp.write(zinfo.FileHeader(zip64))
+            for chunk in data:
+                self.fp.write(chunk)
+
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+            self.start_dir = self.fp.tell()
+
+    def close(self):
+
+        if self.fp is not None:
+            try:
+                self.flush()
+            finally:
+                if self.executor:
+                    self.executor.shutdown()
+        super().close()
 
     def put_metadata(self, comment=None):
         """Create a MANIFEST file and store it within the archive."""
@@ -95,6 +336,10 @@ class ZipFile(zipfile.ZipFile):
         if comment:
             manifest["comment"] = comment
 
+        if self.base and self.delta:
+            # Unchanged files are to be found in the base archive.
+            manifest["base"] = os.path.basename(self.base.filename)
+
         manifest = json.dumps(manifest)
         self.comment = manifest.encode("utf-8")
 
@@ -117,3 +362,91 @@ def strip_mime_parms(mime_type):
         return mime_type[:idx]
     else:
         return mime_type
+
+
+# Relies on zipfile internals, see ZipFile.write_raw.
+def compress_file(filename, arcname, compress_type, compresslevel=None):
+    """Read and compress filename for storing it as arcname in a Zip
+    archive. Return a ZipInfo for it along with the compressed data, or
+    None if the file should be written directly instead.
+
+    """
+
+    zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+    if zinfo.is_dir() or zinfo.file_size > MAX_BUFFERED_SIZE:
+        return None
+
+    with open(filename, "rb") as infile:
+        data = infile.read()
+
+    zinfo.file_size = len(data)
+    zinfo.compress_type = compress_type
+    zinfo.CRC = zlib.crc32(data)
+
+    compressor = zipfile._get_compressor(compress_type, compresslevel)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(data)
+
+    if compress_type == zipfile.ZIP_LZMA:
+        # The data ends with an end-of-stream marker.
+        zinfo.flag_bits |= 0x02
+
+    return zinfo, data
+
+
+def get_member_name(filename, arcname=None):
+    "The name ZipFile.write would give to filename within an archive."
+    if arcname is None:
+        arcname = filename
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    arcname = arcname.lstrip(os.sep + (os.altsep or ""))
+    return zipfile.ZipInfo(arcname).filename
+
+
+def get_crc(filename):
+    "Compute the CRC-32 of a file, as stored in Zip archives."
+    crc = 0
+    with open(filename, "rb") as infile:
+        for chunk in iter(partial(infile.read, COPY_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def get_digest(filename):
+    "Compute the SHA-256 of a file, as a hexadecimal string."
+    digest = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(partial(infile.read, COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Relies on zipfile internals, see ZipFile.write_raw.
+def read_raw(archive, zinfo):
+    """Yield the compressed data of a member of an archive opened for
+    reading, in chunks.
+
+    """
+
+    with archive._lock:
+        archive.fp.seek(zinfo.header_offset)
+        header = archive.fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader:
+            raise zipfile.BadZipFile("Truncated file header")
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        if fields[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile("Bad magic number for file header")
+        archive.fp.seek(
+            fields[zipfile._FH_FILENAME_LENGTH]
+            + fields[zipfile._FH_EXTRA_FIELD_LENGTH],
+            os.SEEK_CUR,
+        )
+
+        remaining = zinfo.compress_size
+        while remaining > 0:
+            chunk = archive.fp.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated member data")
+            remaining -= len(chunk)
+            yield chunk
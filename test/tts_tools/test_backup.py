@@ -0,0 +1,192 @@
+from tts_tools.backup import backup_json
+from tts_tools.backup import MANIFEST_NAME
+from tts_tools.backup.cli import parser
+from tts_tools.backup.store import AssetStore
+from tts_tools.libtts import get_fs_path
+
+import json
+import os
+import pytest
+import threading
+import time
+import zipfile
+
+
+URLS = ["http://example.com/shared.png", "http://example.com/own.png"]
+
+
+def make_gamedata(gamedata_dir, content=b""):
+
+    for url in URLS:
+        filename = gamedata_dir / get_fs_path(["ImageURL"], url)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        filename.write_bytes(content + url.encode("utf-8"))
+    return gamedata_dir
+
+
+def make_save(tmp_path, name, urls):
+
+    filename = str(tmp_path / name)
+    objects = [{"CustomImage": {"ImageURL": url}} for url in urls]
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(dict(SaveName=name, ObjectStates=objects), outfile)
+    return filename
+
+
+# Several saves go into one archive, which holds shared files once,
+# and lists the files of each save in its manifest.
+def test_backup_several_saves(tmp_path, monkeypatch):
+
+    gamedata_dir = make_gamedata(tmp_path / "gamedata")
+
+    saves = [
+        make_save(tmp_path, "one.json", URLS),
+        make_save(tmp_path, "two.json", URLS[:1]),
+    ]
+    archive = str(tmp_path / "archive.zip")
+
+    monkeypatch.chdir(tmp_path)
+    args = parser.parse_args(
+        saves + ["--gamedata", str(gamedata_dir), "--outname", archive]
+    )
+    backup_json(args)
+
+    with zipfile.ZipFile(archive) as infile:
+        names = infile.namelist()
+        assert len(names) == len(set(names)) == 5
+        manifest = json.loads(infile.read(MANIFEST_NAME))
+
+    shared, own = (
+        get_fs_path(["ImageURL"], url).replace(os.sep, "/") for url in URLS
+    )
+    assert manifest["saves"] == {
+        "one.json": dict(name="one.json", files=[shared, own]),
+        "two.json": dict(name="two.json", files=[shared]),
+    }
+
+
+# The asset store holds every file once, and garbage collection keeps
+# what the remaining manifests refer to.
+def test_backup_store(tmp_path, monkeypatch):
+
+    gamedata_dir = make_gamedata(tmp_path / "gamedata")
+
+    saves = [
+        make_save(tmp_path, "one.json", URLS),
+        make_save(tmp_path, "two.json", URLS[:1]),
+    ]
+    store = AssetStore(str(tmp_path / "store"))
+
+    monkeypatch.chdir(tmp_path)
+    args = parser.parse_args(
+        saves + ["--gamedata", str(gamedata_dir), "--store", store.store_dir]
+    )
+    backup_json(args)
+
+    # Two saves and two images.
+    assert len(list(store.blobs())) == 4
+    manifests = sorted(store.manifests())
+    assert len(manifests) == 2
+
+    with open(manifests[1], encoding="utf-8") as infile:
+        manifest = json.load(infile)
+    shared = get_fs_path(["ImageURL"], URLS[0])
+    with open(store.blob_path(manifest["save"]["sha256"]), "rb") as infile:
+        assert json.load(infile)["SaveName"] == "two.json"
+    assert list(manifest["files"]) == [shared.replace(os.sep, "/")]
+
+    # Blobs used recently are kept, as a backup might still need them.
+    os.remove(manifests[0])
+    assert store.collect_garbage() == []
+    removed = store.collect_garbage(grace_period=0)
+    assert len(removed) == 2
+    assert len(list(store.blobs())) == 2
+
+
+# Manifests are named after the saves' paths within the gamedata
+# directory, however many saves are backed up, and backups made within
+# the same second do not replace each other.
+def test_backup_store_manifests(tmp_path, monkeypatch):
+
+    gamedata_dir = make_gamedata(tmp_path / "gamedata")
+    (gamedata_dir / "Saves").mkdir()
+    save = make_save(gamedata_dir / "Saves", "one.json", URLS)
+    store = AssetStore(str(tmp_path / "store"))
+
+    monkeypatch.setattr(time, "strftime", lambda format, t: "20200101")
+    args = parser.parse_args(
+        [save, "--gamedata", str(gamedata_dir), "--store", store.store_dir]
+    )
+    backup_json(args)
+    backup_json(args)
+
+    manifest_dir = os.path.join(store.manifest_dir, "Saves", "one")
+    assert sorted(store.manifests()) == [
+        os.path.join(manifest_dir, "20200101-1.json"),
+        os.path.join(manifest_dir, "20200101.json"),
+    ]
+
+
+def archive_name(tmp_path, n):
+
+    return str(tmp_path / "archive{}.zip".format(n))
+
+
+# Backups from different gamedata directories can run in threads at the
+# same time, without changing the working directory.
+def test_backup_threads(tmp_path):
+
+    save = make_save(tmp_path, "save.json", URLS)
+    cwd = os.getcwd()
+
+    threads = []
+    for n in range(4):
+        gamedata_dir = make_gamedata(
+            tmp_path / "gamedata{}".format(n), b"%d" % n
+        )
+        args = parser.parse_args(
+            [
+                save,
+                "--gamedata",
+                str(gamedata_dir),
+                "--outname",
+                archive_name(tmp_path, n),
+            ]
+        )
+        threads.append(threading.Thread(target=backup_json, args=(args,)))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert os.getcwd() == cwd
+    for n in range(4):
+        with zipfile.ZipFile(archive_name(tmp_path, n)) as infile:
+            for url in URLS:
+                name = get_fs_path(["ImageURL"], url).replace(os.sep, "/")
+                assert infile.read(name) == b"%d" % n + url.encode("utf-8")
+
+
+# An archive rebuilt on top of itself is kept as it is if the backup
+# fails, without leaving the incomplete rebuild behind.
+def test_backup_rebuild_failed(tmp_path):
+
+    gamedata_dir = make_gamedata(tmp_path / "gamedata")
+    save = make_save(tmp_path, "save.json", URLS)
+    archive = archive_name(tmp_path, 0)
+    args = parser.parse_args(
+        [save, "--gamedata", str(gamedata_dir), "--outname", archive]
+    )
+    backup_json(args)
+    with open(archive, "rb") as infile:
+        content = infile.read()
+
+    os.remove(gamedata_dir / get_fs_path(["ImageURL"], URLS[1]))
+    args.base_name = archive
+    with pytest.raises(SystemExit):
+        backup_json(args)
+
+    assert not os.path.exists(archive + ".new")
+    with open(archive, "rb") as infile:
+        assert infile.read() == content
@@ -0,0 +1,65 @@
+from tts_tools.prefetch.cache import classify_http_error
+from tts_tools.prefetch.cache import classify_url_error
+from tts_tools.prefetch.cache import DeadURLCache
+from tts_tools.prefetch.cache import FAILURE_TTLS
+from tts_tools.prefetch.cache import HOUR
+from tts_tools.prefetch.cache import HTTP_ERROR
+from tts_tools.prefetch.cache import NOT_FOUND
+from tts_tools.prefetch.cache import UNAVAILABLE
+from tts_tools.prefetch.cache import UNKNOWN_HOST
+from tts_tools.prefetch.cache import UNREACHABLE
+from urllib.error import URLError
+
+import pytest
+import socket
+import time
+
+
+@pytest.mark.parametrize(
+    "code, failure",
+    [
+        (404, NOT_FOUND),
+        (410, NOT_FOUND),
+        (403, HTTP_ERROR),
+        (408, UNAVAILABLE),
+        (429, UNAVAILABLE),
+        (503, UNAVAILABLE),
+    ],
+)
+def test_classify_http_error(code, failure):
+
+    assert classify_http_error(code) == failure
+
+
+# Only hosts that do not exist are remembered as unknown. Other resolver
+# errors, as when offline, are like unreachable hosts.
+@pytest.mark.parametrize(
+    "reason, failure",
+    [
+        (socket.gaierror(socket.EAI_NONAME, "Name unknown"), UNKNOWN_HOST),
+        (socket.gaierror(socket.EAI_AGAIN, "Try again"), UNREACHABLE),
+        (ConnectionRefusedError(), UNREACHABLE),
+    ],
+)
+def test_classify_url_error(reason, failure):
+
+    assert classify_url_error(URLError(reason)) == failure
+
+
+# Temporary failures are forgotten after a short while.
+def test_dead_url_cache(tmp_path):
+
+    dead_urls = DeadURLCache(str(tmp_path))
+    dead_urls.record("http://example.com/a", NOT_FOUND)
+    dead_urls.record("http://example.com/b", UNAVAILABLE)
+    assert FAILURE_TTLS[UNAVAILABLE] <= HOUR
+    dead_urls.save()
+
+    dead_urls = DeadURLCache(str(tmp_path))
+    assert dead_urls.get_failure("http://example.com/a") == NOT_FOUND
+    assert dead_urls.get_failure("http://example.com/b") == UNAVAILABLE
+
+    entry = dead_urls.get("http://example.com/b")
+    entry["time"] = time.time() - HOUR
+    assert dead_urls.get_failure("http://example.com/b") is None
+    assert dead_urls.get_failure("http://example.com/a") == NOT_FOUND
@@ -0,0 +1,27 @@
+from tts_tools.cacheindex import CacheIndex
+
+import os
+
+
+# CacheIndex lists directories once, and learns about later writes.
+def test_cache_index(tmp_path):
+
+    images = tmp_path / "Mods" / "Images"
+    images.mkdir(parents=True)
+    (images / "a.png").write_bytes(b"a")
+
+    index = CacheIndex(str(tmp_path))
+    assert index.isfile(os.path.join("Mods", "Images", "a.png"))
+    assert index.isfile(str(images / "a.png"))
+    assert not index.isfile(os.path.join("Mods", "Images", "b.png"))
+    assert not index.isfile(os.path.join("Mods", "Models", "a.obj"))
+
+    (images / "b.png").write_bytes(b"bb")
+    assert not index.isfile(str(images / "b.png"))
+    index.update(str(images / "b.png"))
+    assert index.isfile(str(images / "b.png"))
+    assert index.stat(str(images / "b.png")).st_size == 2
+
+    (images / "a.png").unlink()
+    index.update(str(images / "a.png"))
+    assert not index.isfile(str(images / "a.png"))
@@ -0,0 +1,98 @@
+from email.utils import formatdate
+from tts_tools.libtts import IMAGE_TYPE
+from tts_tools.prefetch import Abort
+from tts_tools.prefetch import Downloader
+from tts_tools.prefetch import FAILED
+from tts_tools.prefetch import FetchTask
+from tts_tools.prefetch import TransientError
+from tts_tools.prefetch.cache import DeadURLCache
+from tts_tools.prefetch.cache import ValidatorIndex
+from tts_tools.prefetch.connection import ConnectionPool
+from tts_tools.prefetch.hosts import get_backoff_delay
+from tts_tools.prefetch.hosts import HostPolicy
+from tts_tools.prefetch.hosts import MAX_RETRY_DELAY
+from tts_tools.prefetch.hosts import parse_retry_after
+
+import pytest
+import time
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("120", 120), (" 0 ", 0), ("", None), (None, None), ("soon", None)],
+)
+def test_parse_retry_after_seconds(value, expected):
+
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_date():
+
+    value = formatdate(time.time() + 100, usegmt=True)
+    assert 95 <= parse_retry_after(value) <= 100
+
+    # Dates in the past ask for no delay.
+    value = formatdate(time.time() - 100, usegmt=True)
+    assert parse_retry_after(value) == 0
+
+    # Dates without a time zone are ambiguous.
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00") is None
+
+
+def test_get_backoff_delay():
+
+    for attempt in range(4):
+        delay = get_backoff_delay(attempt, 1)
+        assert 2**attempt / 2 <= delay <= 2**attempt
+
+    assert get_backoff_delay(20, 1) <= MAX_RETRY_DELAY
+
+
+# Once max_failures downloads from a host have failed in a row, the
+# remaining URLs of that host are skipped. Other hosts are unaffected.
+def test_host_policy_circuit_breaker(monkeypatch):
+
+    hosts = HostPolicy(max_failures=2)
+    downloader = Downloader(None, None, None, None, hosts, Abort())
+
+    requested = []
+
+    def fetch_once(task, stats):
+        requested.append(task.url)
+        raise TransientError("Error 503 (Service Unavailable)")
+
+    monkeypatch.setattr(downloader, "fetch_once", fetch_once)
+
+    urls = ["http://broken.example/{}.png".format(n) for n in range(4)]
+    urls.append("http://other.example/0.png")
+    tasks = [FetchTask(url, url, url, IMAGE_TYPE, {}) for url in urls]
+
+    assert [downloader.fetch(task) for task in tasks] == [FAILED] * 5
+    assert requested == urls[:2] + urls[-1:]
+    assert hosts.is_broken("broken.example")
+    assert not hosts.is_broken("other.example")
+
+
+# Malformed URLs fail at once, without retrying them or counting them
+# against their host.
+@pytest.mark.parametrize(
+    "url", ["ftp://example.com/0.png", "http://example.com:port/0.png"]
+)
+def test_malformed_url(tmp_path, url):
+
+    hosts = HostPolicy(max_failures=1)
+    downloader = Downloader(
+        ConnectionPool(),
+        None,
+        ValidatorIndex(str(tmp_path)),
+        DeadURLCache(str(tmp_path)),
+        hosts,
+        Abort(),
+        retries=3,
+    )
+    task = FetchTask(url, url, str(tmp_path / "0.png"), IMAGE_TYPE, {})
+
+    start = time.monotonic()
+    assert downloader.fetch(task) == FAILED
+    assert time.monotonic() - start < 1
+    assert not hosts.is_broken("example.com")
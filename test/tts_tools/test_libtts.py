@@ -1,4 +1,15 @@
+from tts_tools import libtts
+from tts_tools.jsonstream import build_value
+from tts_tools.jsonstream import iterparse
+from tts_tools.libtts import IllegalSavegameException
+from tts_tools.libtts import seek_url_events
+from tts_tools.libtts import seekURL
+
+import io
+import json
+import os
 import pytest
+import sys
 
 
 # seekURL ignores page URLs from a fixture.
@@ -103,6 +114,39 @@ def test_is_pdf_non_pdf_keys():
     pass
 
 
+# Each kind of asset accepts its content types, some of them as exact
+# matches and some as prefixes.
+@pytest.mark.parametrize(
+    "key, mime, expected",
+    [
+        ("MeshURL", "text/plain; charset=utf-8", True),
+        ("MeshURL", "application/octet-stream", True),
+        ("ColliderURL", "application/x-tgif", True),
+        ("MeshURL", "image/png", False),
+        ("AssetbundleURL", "application/binary", True),
+        ("AssetbundleSecondaryURL", "application/octet-stream", True),
+        ("AssetbundleURL", "application/json", False),
+        ("CurrentAudioURL", "audio/mpeg", True),
+        ("AudioLibrary", "audio/ogg", True),
+        ("AudioLibrary", "application/octet-stream", True),
+        ("AudioLibrary", "application/octet-stream; x=y", False),
+        ("AudioLibrary", "video/mp4", False),
+        ("PDFUrl", "application/pdf", True),
+        ("PDFUrl", "application/binary", True),
+        ("PDFUrl", "application/pdfx", False),
+        ("ImageURL", "image/png", True),
+        ("DiffuseURL", "image/jpeg", True),
+        ("ImageSecondaryURL", "video/mp4", True),
+        ("ImageURL", "image/png; charset=binary", False),
+        ("ImageURL", "text/html", False),
+    ],
+)
+def test_asset_type_accepts(key, mime, expected):
+
+    url = "http://example.com/asset"
+    assert libtts.get_asset_type([key], url).accepts(mime) == expected
+
+
 # recodeURL rewrites URLs as expected
 @pytest.mark.skip
 def test_recodeURL():
@@ -110,9 +154,42 @@ def test_recodeURL():
 
 
 # get_fs_path returns cache paths as expected
-@pytest.mark.skip
-def test_get_fs_path():
-    pass
+@pytest.mark.parametrize(
+    "key, url, expected",
+    [
+        ("MeshURL", "http://a.com/m_1.obj", "Models/httpacomm1obj.obj"),
+        ("ColliderURL", "http://a.com/c", "Models/httpacomc.obj"),
+        ("AssetbundleURL", "http://a.com/b", "Assetbundles/httpacomb.unity3d"),
+        (
+            "AssetbundleSecondaryURL",
+            "http://a.com/b",
+            "Assetbundles/httpacomb.unity3d",
+        ),
+        ("CurrentAudioURL", "http://a.com/s.ogg", "Audio/httpacomsogg.MP3"),
+        ("AudioLibrary", "http://a.com/s", "Audio/httpacoms.MP3"),
+        ("PDFUrl", "http://a.com/r.pdf", "PDF/httpacomrpdf.PDF"),
+        ("ImageURL", "http://a.com/i.png", "Images/httpacomipng.png"),
+        ("ImageURL", "http://a.com/i.png?x=1", "Images/httpacomipngx1.png"),
+        ("DiffuseURL", "http://a.com/i.jpg", "Images/httpacomijpg.jpg"),
+        ("ImageURL", "http://a.com/i", "Images/httpacomi.jpg"),
+        # Only “.png” after the start of the URL counts.
+        ("ImageURL", ".png", "Images/png.jpg"),
+    ],
+)
+def test_get_fs_path(key, url, expected):
+
+    expected = os.path.join("Mods", *expected.split("/"))
+    assert libtts.get_fs_path(["ObjectStates", key], url) == expected
+
+
+# get_fs_paths gives the same paths as get_fs_path for each reference.
+def test_get_fs_paths():
+
+    refs = list(seekURL(SAVE)) * 2
+    assert libtts.get_fs_paths(refs) == [
+        libtts.get_fs_path(path, url) for path, url in refs
+    ]
+    assert libtts.get_fs_paths([]) == []
 
 
 # urls_from_save returns expected URLs from a save file fixture
@@ -125,3 +202,207 @@ def test_urls_from_save():
 @pytest.mark.skip
 def test_get_save_name():
     pass
+
+
+SAVE = {
+    "SaveName": 'Test é \\ "save"',
+    "TableURL": "http://example.com/table.jpg",
+    "Lighting": {"LutURL": ""},
+    "MusicPlayer": {
+        "CurrentAudioURL": "http://example.com/current.mp3",
+        "AudioLibrary": [
+            {"Item1": "http://example.com/a.mp3", "Item2": "A"},
+            {"Item1": "http://example.com/b.mp3", "Item2": "B"},
+        ],
+    },
+    "ObjectStates": [
+        {
+            "Name": "Custom_Model",
+            "Transform": {"posX": -1.5e-3, "posY": 2, "scaleX": 1.0},
+            "Locked": True,
+            "Hands": False,
+            "Tooltip": None,
+            "LuaScript": "print('url')\n" * 100,
+            "CustomMesh": {
+                "MeshURL": "http://example.com/mesh.obj",
+                "DiffuseURL": "http://example.com/{verifycache}diffuse.png",
+                "ColliderURL": "",
+            },
+            "ContainedObjects": [
+                {"CustomPDF": {"PDFUrl": "http://example.com/rules.pdf"}},
+                "not a mapping",
+                [{"ImageURL": "http://example.com/nested-list.jpg"}],
+            ],
+            "States": {
+                "2": {"CustomImage": {"ImageURL": "http://example.com/2.jpg"}}
+            },
+        },
+        {"Name": "Tablet", "Tablet": {"PageURL": "http://example.com/"}},
+        {},
+        [],
+    ],
+    "Empty": {},
+    "Nothing": [],
+}
+
+
+# iterparse and build_value reproduce json.load.
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iterparse_build_value(chunk_size):
+
+    text = json.dumps(SAVE, indent=1)
+    events = iterparse(io.StringIO(text), chunk_size)
+    event, value = next(events)
+    assert build_value(events, event, value) == SAVE
+
+
+# Long numbers split across chunks are read in full.
+@pytest.mark.parametrize("chunk_size", range(1, 17))
+def test_iterparse_long_numbers(chunk_size):
+
+    numbers = [3.802302395266917e299, -2.38418579e-07, 12345678901234567890]
+    text = json.dumps(numbers + ["%.9E" % -2.38418579e-07]).replace('"', "")
+    events = iterparse(io.StringIO(text), chunk_size)
+    event, value = next(events)
+    assert build_value(events, event, value) == json.loads(text)
+
+
+# seek_url_events yields the same paths and URLs as seekURL.
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_seek_url_events_like_seekURL(chunk_size):
+
+    text = json.dumps(SAVE)
+    events = iterparse(io.StringIO(text), chunk_size)
+    assert list(seek_url_events(events)) == list(seekURL(SAVE))
+
+
+# seek_url_events rejects anything but a mapping.
+def test_seek_url_events_illegal_savegame():
+
+    events = iterparse(io.StringIO("[1, 2]"))
+    with pytest.raises(IllegalSavegameException):
+        list(seek_url_events(events))
+
+
+# iterparse rejects malformed documents.
+@pytest.mark.parametrize("text", ['{"a": 1,}', '{"a": 1} 2', '{"a" 1}', "[1"])
+def test_iterparse_malformed(text):
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iterparse(io.StringIO(text), 2))
+
+
+# load_save gives the same result whether it streams the save or not.
+@pytest.mark.parametrize("threshold", [0, 2**40])
+def test_load_save(tmp_path, monkeypatch, threshold):
+
+    filename = tmp_path / "save.json"
+    filename.write_text(json.dumps(SAVE), encoding="utf-8")
+    monkeypatch.setattr(libtts, "STREAM_THRESHOLD", threshold)
+
+    savegame = libtts.load_save(filename)
+    assert savegame.name == SAVE["SaveName"]
+    assert savegame.urls == list(seekURL(SAVE))
+    assert savegame.metadata == {"SaveName": SAVE["SaveName"]}
+
+
+# seekURL copes with nesting deeper than the recursion limit.
+def test_seekURL_deep_nesting():
+
+    depth = sys.getrecursionlimit() * 2
+    save = obj = {}
+    for _ in range(depth):
+        child = {}
+        obj["ContainedObjects"] = [child]
+        obj = child
+    obj["ImageURL"] = "http://example.com/deep.png"
+
+    [(path, url)] = seekURL(save)
+    assert path == ["ContainedObjects"] * depth + ["ImageURL"]
+    assert url == "http://example.com/deep.png"
+
+
+# load_saves keeps the order of the saves, and raises errors in turn.
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize(
+    "content, error",
+    [(None, FileNotFoundError), ([1, 2], libtts.IllegalSavegameException)],
+)
+def test_load_saves(tmp_path, workers, content, error):
+
+    filenames = []
+    for n in range(4):
+        filename = str(tmp_path / "save{}.json".format(n))
+        with open(filename, "w", encoding="utf-8") as outfile:
+            json.dump(dict(SAVE, SaveName=str(n)), outfile)
+        filenames.append(filename)
+
+    filename = str(tmp_path / "bad.json")
+    if content is not None:
+        with open(filename, "w", encoding="utf-8") as outfile:
+            json.dump(content, outfile)
+    filenames.append(filename)
+
+    savegames = libtts.load_saves(filenames, workers)
+    assert [next(savegames).name for _ in range(4)] == ["0", "1", "2", "3"]
+    with pytest.raises(error):
+        next(savegames)
+
+
+# find_saves lists saves and workshop mods, filtered by globs.
+def test_find_saves(tmp_path):
+
+    names = [
+        "Saves/TS_Save_1.json",
+        "Saves/SaveFileInfos.json",
+        "Saves/Chest/TS_Save_2.json",
+        "Saves/TS_Save_1.png",
+        "Mods/Workshop/123.json",
+        "Mods/Workshop/WorkshopFileInfos.json",
+        "Mods/Images/x.json",
+    ]
+    for name in names:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("{}")
+
+    def find(include=(), exclude=()):
+        saves = libtts.find_saves(str(tmp_path), include, exclude)
+        return [os.path.relpath(save, str(tmp_path)) for save in saves]
+
+    assert find() == [
+        os.path.join("Saves", "TS_Save_1.json"),
+        os.path.join("Saves", "Chest", "TS_Save_2.json"),
+        os.path.join("Mods", "Workshop", "123.json"),
+    ]
+    assert find(include=["Mods/*"]) == [
+        os.path.join("Mods", "Workshop", "123.json")
+    ]
+    assert find(exclude=["Saves/Chest/*", "Mods/*"]) == [
+        os.path.join("Saves", "TS_Save_1.json")
+    ]
+
+
+# AssetTable keeps the references of the fixture, and counts them by kind.
+def test_asset_table():
+
+    refs = list(seekURL(SAVE)) * 2
+    table = libtts.AssetTable(refs)
+
+    assert len(table) == len(refs)
+    assert list(table) == [([path[-1]], url) for path, url in refs]
+    assert len(table.urls) == len(refs) // 2
+    assert table.count(libtts.AUDIO) == 6
+    assert table.count_by_kind() == {
+        libtts.OBJ: 2,
+        libtts.AUDIO: 6,
+        libtts.PDF: 2,
+        libtts.IMAGE: 6,
+    }
+    assert table.group_by_kind()[libtts.OBJ] == ["http://example.com/mesh.obj"]
+
+    # Each distinct reference is yielded once, also within given rows.
+    unique = [([path[-1]], url) for path, url in refs[: len(refs) // 2]]
+    assert list(table.distinct()) == unique
+    rows = table.extend(refs[:1])
+    assert rows == range(len(refs), len(refs) + 1)
+    assert list(table.distinct(rows)) == unique[:1]
@@ -0,0 +1,396 @@
+from tts_tools.libtts import get_fs_path
+from tts_tools.prefetch import CACHED
+from tts_tools.prefetch import DOWNLOADED
+from tts_tools.prefetch import NOT_MODIFIED
+from tts_tools.prefetch import PART_SUFFIX
+from tts_tools.prefetch import prefetch_file
+from tts_tools.prefetch import prefetch_files
+from tts_tools.prefetch import prefetch_saves
+from tts_tools.prefetch.cache import ValidatorIndex
+from tts_tools.prefetch.cli import parser
+from tts_tools.prefetch.connection import ConnectionPool
+
+import base64
+import http.server
+import json
+import os
+import pytest
+import re
+import threading
+
+
+BODY = bytes(range(256)) * 64
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+class Server:
+    """A local HTTP server for a single image, whose answers to range
+    and conditional requests can be changed by the tests.
+
+    """
+
+    def __init__(self):
+
+        self.etag = ETAG
+        self.last_modified = LAST_MODIFIED
+        # Send only this many bytes of the body, then hang up.
+        self.cut_at = None
+        # How to answer range requests: "honor", "416" or "mismatch".
+        self.ranges = "honor"
+        self.content_type = "image/png"
+        # Called on every request, if given.
+        self.hook = None
+        self.requests = []
+        self.paths = []
+        self.connections = 0
+
+        self.httpd = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), make_handler(self)
+        )
+        self.httpd.daemon_threads = True
+        # Clients hang up early on purpose in some tests.
+        self.httpd.handle_error = lambda request, client_address: None
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, args=(0.05,)
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    @property
+    def url(self):
+
+        return self.url_of("image.png")
+
+    def url_of(self, name):
+
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/{}".format(host, port, name)
+
+
+def make_handler(server):
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def setup(self):
+
+            server.connections += 1
+            super().setup()
+
+        def do_GET(self):
+
+            server.requests.append(dict(self.headers))
+            server.paths.append(self.path)
+            if server.hook:
+                server.hook()
+
+            if self.path.endswith("/redirect"):
+                self.send_response(302)
+                self.send_header("Location", "/image.png")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if self.path.endswith("/missing"):
+                body = b"Not found"
+                self.send_response(404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            not_modified = (
+                server.etag
+                and self.headers.get("If-None-Match") == server.etag
+            ) or (
+                server.last_modified
+                and self.headers.get("If-Modified-Since")
+                == server.last_modified
+            )
+            if not_modified:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start = 0
+            match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+            if match and server.ranges == "416":
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if match:
+                start = int(match.group(1))
+
+            # A mismatched range starts elsewhere than requested.
+            range_start = 0 if server.ranges == "mismatch" else start
+            body = BODY[range_start:]
+
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", server.content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if server.etag:
+                self.send_header("ETag", server.etag)
+            if server.last_modified:
+                self.send_header("Last-Modified", server.last_modified)
+            if start:
+                self.send_header(
+                    "Content-Range",
+                    "bytes {}-{}/{}".format(
+                        range_start, len(BODY) - 1, len(BODY)
+                    ),
+                )
+            self.end_headers()
+
+            if server.cut_at is not None:
+                self.wfile.write(body[: server.cut_at])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def server():
+
+    server = Server()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def gamedata_dir(tmp_path):
+
+    gamedata_dir = tmp_path / "gamedata"
+    (gamedata_dir / "Mods" / "Images").mkdir(parents=True)
+    return str(gamedata_dir)
+
+
+def make_save(gamedata_dir, urls, name="save.json"):
+    "Write a save referring to the images at urls, and return its name."
+
+    filename = os.path.join(gamedata_dir, name)
+    objects = [{"CustomImage": {"ImageURL": url}} for url in urls]
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(dict(SaveName=name, ObjectStates=objects), outfile)
+    return filename
+
+
+def prefetch(server, gamedata_dir, **kwargs):
+    """Prefetch a save referring to the image on server, and return the
+    name of its cache file.
+
+    """
+
+    filename = make_save(gamedata_dir, [server.url])
+    prefetch_file(filename, gamedata_dir=gamedata_dir, timeout=5, **kwargs)
+    return os.path.join(gamedata_dir, get_fs_path(["ImageURL"], server.url))
+
+
+def read(filename):
+
+    with open(filename, "rb") as infile:
+        return infile.read()
+
+
+def write_partial(server, gamedata_dir, size):
+    "Leave a partial download behind, along with its validator."
+
+    outfile_name = os.path.join(
+        gamedata_dir, get_fs_path(["ImageURL"], server.url)
+    )
+    with open(outfile_name + PART_SUFFIX, "wb") as outfile:
+        outfile.write(BODY[:size])
+
+    validators = ValidatorIndex(gamedata_dir)
+    validators.set(server.url, dict(partial=ETAG))
+    validators.save()
+
+
+# Interrupted downloads are kept as .part files, never in the cache, and
+# are resumed with a range request.
+def test_prefetch_resume(server, gamedata_dir):
+
+    server.cut_at = 1000
+    outfile_name = prefetch(server, gamedata_dir)
+    assert not os.path.exists(outfile_name)
+    assert read(outfile_name + PART_SUFFIX) == BODY[:1000]
+    assert ValidatorIndex(gamedata_dir).get(server.url)["partial"] == ETAG
+
+    server.cut_at = None
+    prefetch(server, gamedata_dir)
+    assert server.requests[-1]["Range"] == "bytes=1000-"
+    assert server.requests[-1]["If-Range"] == ETAG
+    assert read(outfile_name) == BODY
+    assert not os.path.exists(outfile_name + PART_SUFFIX)
+    assert "partial" not in ValidatorIndex(gamedata_dir).get(server.url)
+
+
+# Partial downloads that cannot be resumed are fetched from the start.
+@pytest.mark.parametrize("ranges", ["416", "mismatch"])
+def test_prefetch_resume_fallback(server, gamedata_dir, ranges):
+
+    write_partial(server, gamedata_dir, 1000)
+    server.ranges = ranges
+
+    outfile_name = prefetch(server, gamedata_dir)
+    assert server.requests[0]["Range"] == "bytes=1000-"
+    assert "Range" not in server.requests[-1]
+    assert read(outfile_name) == BODY
+    assert not os.path.exists(outfile_name + PART_SUFFIX)
+
+
+# When refetching, cached files are revalidated with the validators sent
+# along with them.
+@pytest.mark.parametrize(
+    "etag, last_modified", [(ETAG, None), (None, LAST_MODIFIED)]
+)
+def test_prefetch_revalidate(server, gamedata_dir, etag, last_modified):
+
+    server.etag = etag
+    server.last_modified = last_modified
+    outfile_name = prefetch(server, gamedata_dir)
+    assert read(outfile_name) == BODY
+    mtime = os.stat(outfile_name).st_mtime_ns
+
+    prefetch(server, gamedata_dir, refetch=True)
+    headers = server.requests[-1]
+    assert headers.get("If-None-Match") == etag
+    assert headers.get("If-Modified-Since") == last_modified
+    assert len(server.requests) == 2
+    assert os.stat(outfile_name).st_mtime_ns == mtime
+
+
+# Downloads reuse keep-alive connections, also after redirects and error
+# responses, and open no more connections than there are jobs.
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_prefetch_connections(server, gamedata_dir, jobs):
+
+    names = ["image{}.png".format(n) for n in range(20)]
+    urls = [server.url_of(name) for name in names]
+    urls += [server.url_of("redirect"), server.url_of("missing")]
+    filename = make_save(gamedata_dir, urls)
+
+    prefetch_saves([filename], gamedata_dir=gamedata_dir, jobs=jobs)
+
+    assert 1 <= server.connections <= jobs
+    assert server.paths.count("/image.png") == 1
+    assert "/missing" in server.paths
+    for url in urls[:-1]:
+        outfile_name = os.path.join(
+            gamedata_dir, get_fs_path(["ImageURL"], url)
+        )
+        assert read(outfile_name) == BODY
+
+
+# Requests through a proxy carry the credentials of the proxy URL.
+def test_proxy_authorization(server):
+
+    pool = ConnectionPool()
+    pool.proxies = dict(http=server.url_of("").replace("//", "//us%40er:pw@"))
+
+    with pool, pool.get("http://example.com/image.png") as response:
+        assert response.read() == BODY
+
+    assert server.paths == ["http://example.com/image.png"]
+    assert server.requests[0]["Proxy-Authorization"] == "Basic {}".format(
+        base64.b64encode(b"us@er:pw").decode("ascii")
+    )
+
+
+# Releasing the GUI's semaphore once stops every worker.
+def test_prefetch_abort(server, gamedata_dir, capsys):
+
+    semaphore = threading.Semaphore(0)
+
+    def hook():
+        if len(server.paths) == 1:
+            semaphore.release()
+
+    server.hook = hook
+    urls = [server.url_of("image{}.png".format(n)) for n in range(20)]
+    filename = make_save(gamedata_dir, urls)
+
+    report_name = os.path.join(gamedata_dir, "report.json")
+    prefetch_saves(
+        [filename],
+        gamedata_dir=gamedata_dir,
+        jobs=3,
+        semaphore=semaphore,
+        report_name=report_name,
+    )
+
+    assert len(server.paths) <= 3
+    assert capsys.readouterr().out.endswith("Aborted.\n")
+
+    # The report covers the downloads made so far.
+    with open(report_name, encoding="utf-8") as infile:
+        assert len(json.load(infile)["records"]) <= 3
+
+
+# A content type that does not match the asset aborts the run, also when
+# the download fails in a worker thread.
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_prefetch_content_type(server, gamedata_dir, jobs):
+
+    server.content_type = "text/html"
+    urls = [server.url_of("image{}.png".format(n)) for n in range(5)]
+    filename = make_save(gamedata_dir, urls)
+
+    args = parser.parse_args(
+        [filename, "--gamedata", gamedata_dir, "--jobs", str(jobs)]
+    )
+    with pytest.raises(SystemExit) as excinfo:
+        prefetch_files(args)
+    assert excinfo.value.code == 1
+
+
+# An asset shared by several saves is fetched once, and counted in the
+# summary of each save.
+def test_prefetch_shared(server, gamedata_dir, capsys):
+
+    shared = server.url_of("shared.png")
+    saves = [
+        make_save(gamedata_dir, [shared, server.url], "one.json"),
+        make_save(gamedata_dir, [shared, shared], "two.json"),
+    ]
+
+    prefetch_saves(saves, gamedata_dir=gamedata_dir)
+
+    assert server.paths == ["/shared.png", "/image.png"]
+    out = capsys.readouterr().out.splitlines()
+    assert out[-2:] == [
+        "Prefetching {} completed (2 assets: 2 downloaded).".format(saves[0]),
+        "Prefetching {} completed (1 assets: 1 downloaded).".format(saves[1]),
+    ]
+
+
+# The report counts assets as cached if they were found in the cache, or
+# not modified on the server.
+def test_prefetch_report(server, gamedata_dir):
+
+    report_name = os.path.join(gamedata_dir, "report.json")
+
+    def run(**kwargs):
+        prefetch(server, gamedata_dir, report_name=report_name, **kwargs)
+        with open(report_name, encoding="utf-8") as infile:
+            (record,) = json.load(infile)["records"]
+        return record["result"], record["cached"]
+
+    assert run() == (DOWNLOADED, False)
+    assert run(refetch=True) == (NOT_MODIFIED, True)
+    assert run() == (CACHED, True)
@@ -0,0 +1,74 @@
+from tts_tools.prefetch.report import Report
+
+import csv
+import json
+import pytest
+
+
+def make_report():
+
+    report = Report()
+    report.add(
+        url="http://a.example/1",
+        host="a.example",
+        result="downloaded",
+        bytes=3000,
+        total_time=1.0,
+    )
+    report.add(
+        url="http://a.example/0",
+        host="a.example",
+        result="downloaded",
+        bytes=1000,
+        total_time=3.0,
+    )
+    report.add(
+        url="http://b.example/0",
+        host="b.example",
+        result="not modified",
+        cached=True,
+        bytes=0,
+        total_time=0.5,
+    )
+    report.add(url="http://c.example/0", host="c.example", result="cached")
+    return report
+
+
+# Totals count results, and list hosts by their mean time per request.
+def test_report_totals():
+
+    totals = make_report().totals()
+    assert totals["urls"] == 4
+    assert totals["bytes"] == 4000
+    assert totals["results"] == {
+        "downloaded": 2,
+        "not modified": 1,
+        "cached": 1,
+    }
+    assert totals["slowest_hosts"] == [
+        dict(host="a.example", requests=2, mean_time=2.0),
+        dict(host="b.example", requests=1, mean_time=0.5),
+    ]
+    assert totals["throughput"] == 4000 / totals["wall_time"]
+
+
+# Reports are written as CSV or JSON, sorted by URL.
+@pytest.mark.parametrize("name", ["report.csv", "report.json"])
+def test_report_write(tmp_path, name):
+
+    filename = str(tmp_path / name)
+    make_report().write(filename)
+
+    with open(filename, newline="", encoding="utf-8") as infile:
+        if name.endswith(".csv"):
+            records = list(csv.DictReader(infile))
+        else:
+            records = json.load(infile)["records"]
+
+    assert [record["url"] for record in records] == [
+        "http://a.example/0",
+        "http://a.example/1",
+        "http://b.example/0",
+        "http://c.example/0",
+    ]
+    assert list(records[0]) == list(Report.fields)
@@ -0,0 +1,55 @@
+from tts_tools.libtts import load_save
+from tts_tools.saveindex import SaveIndex
+
+import json
+import os
+import sqlite3
+
+
+SAVE = {
+    "SaveName": "Indexed",
+    "ObjectStates": [{"CustomImage": {"ImageURL": "http://example.com/a"}}],
+}
+
+
+# SaveIndex returns what load_save does, and notices changed saves.
+def test_save_index(tmp_path):
+
+    filename = str(tmp_path / "save.json")
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(SAVE, outfile)
+
+    index = SaveIndex(str(tmp_path))
+    assert index.load_save(filename) == load_save(filename)
+    assert index.load_save(filename) == load_save(filename)
+
+    # Same size, new content and mtime.
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(dict(SAVE, SaveName="Changed"), outfile)
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert index.load_save(filename).name == "Changed"
+    index.close()
+
+
+# Saves are parsed if the index is locked by another run.
+def test_save_index_locked(tmp_path):
+
+    filename = str(tmp_path / "save.json")
+    with open(filename, "w", encoding="utf-8") as outfile:
+        json.dump(SAVE, outfile)
+
+    index = SaveIndex(str(tmp_path))
+    other = sqlite3.connect(index.filename)
+    other.execute("BEGIN EXCLUSIVE")
+    index.connection.execute("PRAGMA busy_timeout = 0")
+
+    try:
+        assert index.load_save(filename) == load_save(filename)
+        assert index.connection is None
+        assert index.load_save(filename) == load_save(filename)
+    finally:
+        other.rollback()
+        other.close()
+        index.close()
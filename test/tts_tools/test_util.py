@@ -0,0 +1,118 @@
+from tts_tools.util import compress_file
+from tts_tools.util import get_member_name
+from tts_tools.util import ZipFile
+from zipfile import ZIP_BZIP2
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_LZMA
+from zipfile import ZIP_STORED
+
+import json
+import os
+import pytest
+import zipfile
+
+
+# ZipFile writes members in order, compressed as requested, with and
+# without worker threads.
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_zipfile_compression(tmp_path, jobs):
+
+    methods = [ZIP_STORED, ZIP_DEFLATED, ZIP_LZMA] * 3
+    names = []
+    for n, method in enumerate(methods):
+        name = tmp_path / "file{}.txt".format(n)
+        name.write_bytes(b"content %d " % n * 1000)
+        names.append(str(name))
+
+    archive = str(tmp_path / "archive.zip")
+    with ZipFile(archive, "w", jobs=jobs) as outfile:
+        for name, method in zip(names, methods):
+            outfile.write(name, compress_type=method)
+        outfile.write(names[0])
+
+    with zipfile.ZipFile(archive) as infile:
+        assert infile.testzip() is None
+        infos = infile.infolist()
+        assert [info.compress_type for info in infos] == methods
+        for info, name in zip(infos, names):
+            with open(name, "rb") as original:
+                assert infile.read(info) == original.read()
+
+
+# Members unchanged since the base archive are copied from it, or left
+# out of a delta archive; changed ones are written anew.
+@pytest.mark.parametrize("delta", [False, True])
+def test_zipfile_base(tmp_path, delta):
+
+    names = []
+    for n in range(3):
+        name = tmp_path / "file{}.txt".format(n)
+        name.write_bytes(b"content %d " % n * 1000)
+        names.append(str(name))
+
+    base_name = str(tmp_path / "base.zip")
+    with ZipFile(base_name, "w") as outfile:
+        for name in names:
+            outfile.write(name, compress_type=ZIP_DEFLATED)
+
+    # Changed content of the same size, and a new modification time
+    # for unchanged content.
+    with open(names[1], "r+b") as outfile:
+        outfile.write(b"C")
+    for name in names[1:]:
+        os.utime(name, (0, 10**9))
+
+    archive = str(tmp_path / "archive.zip")
+    with ZipFile(base_name) as base:
+        with ZipFile(archive, "w", base=base, delta=delta) as outfile:
+            for name in names:
+                outfile.write(name, compress_type=ZIP_DEFLATED)
+            outfile.put_metadata()
+        assert outfile.unchanged_count == 2
+
+    with zipfile.ZipFile(archive) as infile:
+        assert infile.testzip() is None
+        written = names[1:2] if delta else names
+        assert len(infile.infolist()) == len(written)
+        for name in written:
+            with open(name, "rb") as original:
+                assert infile.read(name.lstrip("/")) == original.read()
+        assert ("base" in json.loads(infile.comment)) == delta
+
+
+# Members compressed by compress_file and written by write_raw, or copied
+# by copy_member, make up valid archives. These helpers use zipfile
+# internals, which this guards against changes in.
+def test_zipfile_raw(tmp_path):
+
+    methods = [ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA]
+    contents = [b"", b"content " * 1000]
+    names = []
+    for method in methods:
+        for content in contents:
+            name = tmp_path / "file{}.txt".format(len(names))
+            name.write_bytes(content)
+            names.append((str(name), method, content))
+
+    archive = str(tmp_path / "archive.zip")
+    with ZipFile(archive, "w") as outfile:
+        for name, method, content in names:
+            zinfo, data = compress_file(name, get_member_name(name), method)
+            # Data may be given in chunks.
+            outfile.write_raw(zinfo, [data[:10], data[10:]])
+
+    copy_name = str(tmp_path / "copy.zip")
+    with ZipFile(archive) as base:
+        with ZipFile(copy_name, "w", base=base) as outfile:
+            for info in base.infolist():
+                outfile.copy_member(info)
+
+    for filename in (archive, copy_name):
+        with zipfile.ZipFile(filename) as infile:
+            assert infile.testzip() is None
+            infos = infile.infolist()
+            assert [info.compress_type for info in infos] == [
+                method for name, method, content in names
+            ]
+            for info, (name, method, content) in zip(infos, names):
+                assert infile.read(info) == content